@@ -3,6 +3,8 @@ from flask_cors import CORS
 
 from controllers.consultas_controller import consultas_bp
 from controllers.medicos_controller import medicos_bp
+from db import PoolExhausted, pool_stats
+from services.medicos_service import medicos_cache
 
 def create_app():
     app = Flask(__name__)
@@ -11,10 +13,23 @@ def create_app():
     app.register_blueprint(consultas_bp, url_prefix="/consultas")
     app.register_blueprint(medicos_bp, url_prefix="/medicos")
 
+    @app.errorhandler(PoolExhausted)
+    def pool_exhausted(e):
+        # Pool ocupado: contrapresión al llamador en lugar de failover
+        return {"error": str(e)}, 503, {"Retry-After": "1"}
+
     @app.get("/")
     def home():
         return {"status": "ok", "app": "App1 - Gestión Médica"}
 
+    @app.get("/status")
+    def status():
+        return {
+            "status": "ok",
+            "db_pool": pool_stats(),
+            "medicos_cache": medicos_cache.stats()
+        }
+
     return app
 
 if __name__ == "__main__":
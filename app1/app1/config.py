@@ -0,0 +1,49 @@
+import os
+from dotenv import load_dotenv
+
+load_dotenv()
+
+class Config:
+    # Base de datos
+    DB_HOST = os.getenv("DB_HOST", "mariadb-master")
+    DB_REPLICA_HOST = os.getenv("DB_REPLICA_HOST", "mariadb-replica")
+    DB_PORT = int(os.getenv("DB_PORT", "3306"))
+    DB_USER = os.getenv("DB_USER", "appuser")
+    DB_PASSWORD = os.getenv("DB_PASSWORD", "apppass")
+    DB_NAME = os.getenv("DB_NAME", "gestion_medica")
+    # Driver MySQL en Python puro: con workers gevent es obligatorio, porque el
+    # monkey-patching no vuelve cooperativos los sockets de la extensión C
+    DB_USE_PURE = os.getenv(
+        "DB_USE_PURE",
+        "true" if os.getenv("GUNICORN_WORKER_CLASS") == "gevent" else "false"
+    ).lower() == "true"
+
+    # Pool de conexiones (uno por host: primary y replica)
+    DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "10"))  # conexiones máximas por host
+    DB_POOL_ACQUIRE_TIMEOUT = float(os.getenv("DB_POOL_ACQUIRE_TIMEOUT", "5"))  # segundos esperando una conexión libre
+    DB_POOL_IDLE_TIMEOUT = float(os.getenv("DB_POOL_IDLE_TIMEOUT", "300"))  # segundos antes de descartar una conexión ociosa
+    DB_POOL_VALIDATE_AFTER = float(os.getenv("DB_POOL_VALIDATE_AFTER", "5"))  # ping al prestar si estuvo ociosa más que esto
+
+    # Separación lectura/escritura: las lecturas van a la réplica si está al día
+    DB_READ_FROM_REPLICA = os.getenv("DB_READ_FROM_REPLICA", "true").lower() == "true"
+    DB_REPLICA_MAX_LAG = int(os.getenv("DB_REPLICA_MAX_LAG", "5"))  # Seconds_Behind_Master tolerado
+    DB_REPLICA_LAG_CHECK_INTERVAL = float(os.getenv("DB_REPLICA_LAG_CHECK_INTERVAL", "2"))  # segundos entre chequeos de lag
+
+    # Paginación de GET /consultas/
+    CONSULTAS_PAGE_DEFAULT = int(os.getenv("CONSULTAS_PAGE_DEFAULT", "100"))
+    CONSULTAS_PAGE_MAX = int(os.getenv("CONSULTAS_PAGE_MAX", "1000"))
+
+    # Exportación NDJSON de consultas
+    CONSULTAS_EXPORT_CHUNK = int(os.getenv("CONSULTAS_EXPORT_CHUNK", "500"))  # filas por bloque enviado
+
+    # Registro masivo POST /consultas/bulk
+    CONSULTAS_BULK_MAX = int(os.getenv("CONSULTAS_BULK_MAX", "500"))  # filas máximas por lote
+
+    # Conexiones que cada worker abre al arrancar (pre-calentamiento del pool)
+    DB_POOL_WARM = int(os.getenv("DB_POOL_WARM", "2"))
+
+    # Caché en memoria del listado de médicos (por proceso worker)
+    MEDICOS_CACHE_TTL = float(os.getenv("MEDICOS_CACHE_TTL", "30"))  # segundos; 0 desactiva la caché
+
+    # Actualización masiva de disponibilidad POST /medicos/disponibilidad/bulk
+    MEDICOS_BULK_MAX = int(os.getenv("MEDICOS_BULK_MAX", "500"))  # médicos máximos por lote
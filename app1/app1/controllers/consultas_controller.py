@@ -1,17 +1,36 @@
-from flask import Blueprint, request
+from flask import Blueprint, Response, request
 from services.consultas_service import *
 
 consultas_bp = Blueprint("consultas", __name__)
 
 @consultas_bp.get("/")
 def listar_consultas():
-    return listar_consultas_service()
+    return listar_consultas_service(
+        cursor=request.args.get("cursor"),
+        limit=request.args.get("limit"),
+        fields=request.args.get("fields")
+    )
+
+@consultas_bp.get("/export")
+def exportar_consultas():
+    body, status = exportar_consultas_service(fields=request.args.get("fields"))
+    if status != 200:
+        return body, status
+    # Sin stream_with_context: la exportación no usa el contexto de la petición
+    # y así el servidor WSGI llama body.close() aunque la respuesta nunca se
+    # itere (cliente desconectado), devolviendo la conexión al pool
+    return Response(body, mimetype="application/x-ndjson")
 
 @consultas_bp.post("/")
 def registrar_consulta():
     data = request.json
     return registrar_consulta_service(data)
 
+@consultas_bp.post("/bulk")
+def registrar_consultas_bulk():
+    data = request.get_json(silent=True)
+    return registrar_consultas_bulk_service(data)
+
 @consultas_bp.get("/paciente/<id_paciente>")
 def historial_paciente(id_paciente):
-    return historial_paciente_service(id_paciente)
+    return historial_paciente_service(id_paciente, if_none_match=request.if_none_match)
@@ -5,9 +5,14 @@ medicos_bp = Blueprint("medicos", __name__)
 
 @medicos_bp.get("/")
 def listar_medicos():
-    return listar_medicos_service()
+    return listar_medicos_service(if_none_match=request.if_none_match)
 
 @medicos_bp.post("/disponibilidad")
 def actualizar_disponibilidad():
     data = request.json
     return actualizar_disponibilidad_service(data)
+
+@medicos_bp.post("/disponibilidad/bulk")
+def actualizar_disponibilidad_bulk():
+    data = request.get_json(silent=True)
+    return actualizar_disponibilidad_bulk_service(data)
@@ -1,9 +1,12 @@
-import os
 import time
 import logging
+import threading
+from collections import deque
 import mysql.connector
 from mysql.connector import Error
 
+from config import Config
+
 # Configurar logging
 logging.basicConfig(
     level=logging.INFO,
@@ -14,72 +17,402 @@ logger = logging.getLogger('App1-DB')
 # Cache del último host exitoso para optimizar conexiones
 _last_successful_host = None
 
-def get_connection(max_retries=5, retry_delay=2):
+
+class PoolExhausted(Error):
+    """No hay conexiones libres en el pool dentro del tiempo de espera"""
+
+
+class PooledConnection:
+    """
+    Envoltura de una conexión prestada por el pool.
+
+    Delega todo en la conexión real, salvo close(), que la devuelve al pool
+    en lugar de cerrarla. Así los servicios mantienen el patrón
+    `finally: conn.close()` y la conexión se reutiliza.
+    """
+
+    def __init__(self, pool, conn):
+        self._pool = pool
+        self._conn = conn
+        self.host = pool.host
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+    def close(self):
+        """Devuelve la conexión al pool (idempotente)"""
+        if self._conn is not None:
+            conn, self._conn = self._conn, None
+            self._pool.release(conn)
+
+    def discard(self):
+        """Cierra la conexión real y libera su cupo sin devolverla al pool (idempotente)"""
+        if self._conn is not None:
+            conn, self._conn = self._conn, None
+            self._pool.release(conn, reusable=False)
+
+
+class ConnectionPool:
+    """
+    Pool acotado de conexiones MariaDB para un host.
+
+    - Tamaño máximo por host (DB_POOL_SIZE)
+    - Validación con ping al prestar si la conexión estuvo ociosa
+    - Desalojo de conexiones ociosas más allá de DB_POOL_IDLE_TIMEOUT
+    - Estadísticas de uso para /status
+    """
+
+    def __init__(self, host):
+        self.host = host
+        self.max_size = Config.DB_POOL_SIZE
+        self._idle = deque()  # (conexión, instante de devolución)
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(self.max_size)
+        self._in_use = 0
+        self._stats = {
+            "created": 0,
+            "reused": 0,
+            "validation_failures": 0,
+            "evicted_idle": 0,
+            "acquire_timeouts": 0,
+        }
+
+    def _connect(self):
+        conn = mysql.connector.connect(
+            host=self.host,
+            port=Config.DB_PORT,
+            user=Config.DB_USER,
+            password=Config.DB_PASSWORD,
+            database=Config.DB_NAME,
+            connect_timeout=5,
+            use_pure=Config.DB_USE_PURE
+        )
+        with self._lock:
+            self._stats["created"] += 1
+        return conn
+
+    def _discard(self, conn):
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    def _take_idle(self):
+        """Saca una conexión ociosa válida, desalojando las vencidas"""
+        while True:
+            with self._lock:
+                if not self._idle:
+                    return None
+                conn, released_at = self._idle.pop()
+
+            idle_for = time.monotonic() - released_at
+            if idle_for > Config.DB_POOL_IDLE_TIMEOUT:
+                with self._lock:
+                    self._stats["evicted_idle"] += 1
+                self._discard(conn)
+                continue
+
+            if idle_for > Config.DB_POOL_VALIDATE_AFTER:
+                try:
+                    conn.ping(reconnect=False)
+                except Error:
+                    with self._lock:
+                        self._stats["validation_failures"] += 1
+                    self._discard(conn)
+                    continue
+
+            with self._lock:
+                self._stats["reused"] += 1
+            return conn
+
+    def acquire(self, timeout=None):
+        """
+        Presta una conexión del pool.
+
+        Raises:
+            PoolExhausted: si no se libera ningún cupo dentro del timeout
+            mysql.connector.Error: si no se puede abrir una conexión nueva
+        """
+        timeout = Config.DB_POOL_ACQUIRE_TIMEOUT if timeout is None else timeout
+        if not self._slots.acquire(timeout=timeout):
+            with self._lock:
+                self._stats["acquire_timeouts"] += 1
+            raise PoolExhausted(msg=f"Pool de {self.host} agotado ({self.max_size} conexiones en uso)")
+
+        try:
+            conn = self._take_idle() or self._connect()
+        except Exception:
+            self._slots.release()
+            raise
+
+        with self._lock:
+            self._in_use += 1
+        return PooledConnection(self, conn)
+
+    def release(self, conn, reusable=True):
+        """Devuelve una conexión al pool, descartándola si quedó inservible"""
+        try:
+            if reusable:
+                # Cerrar la transacción implícita para no arrastrar snapshots viejos
+                conn.rollback()
+                with self._lock:
+                    self._idle.append((conn, time.monotonic()))
+            else:
+                self._discard(conn)
+        except Exception:
+            self._discard(conn)
+        finally:
+            with self._lock:
+                self._in_use -= 1
+            self._slots.release()
+
+    def evict_idle(self):
+        """Cierra las conexiones ociosas vencidas sin esperar a un préstamo"""
+        now = time.monotonic()
+        with self._lock:
+            keep = deque(item for item in self._idle if now - item[1] <= Config.DB_POOL_IDLE_TIMEOUT)
+            expired = [item[0] for item in self._idle if now - item[1] > Config.DB_POOL_IDLE_TIMEOUT]
+            self._idle = keep
+            self._stats["evicted_idle"] += len(expired)
+        for conn in expired:
+            self._discard(conn)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "host": self.host,
+                "max_size": self.max_size,
+                "in_use": self._in_use,
+                "idle": len(self._idle),
+                **self._stats,
+            }
+
+
+# Un pool por host; se crean al primer uso
+_pools = {}
+_pools_lock = threading.Lock()
+
+def get_pool(host):
+    """Obtiene (o crea) el pool de conexiones de un host"""
+    with _pools_lock:
+        pool = _pools.get(host)
+        if pool is None:
+            pool = _pools[host] = ConnectionPool(host)
+        return pool
+
+# Estado de la réplica para el ruteo de lecturas (se refresca cada DB_REPLICA_LAG_CHECK_INTERVAL)
+_replica_state = {"usable": False, "lag": None, "checked_at": None}
+_replica_lock = threading.Lock()
+
+def pool_stats():
+    """Estadísticas de todos los pools"""
+    with _pools_lock:
+        pools = list(_pools.values())
+    for pool in pools:
+        pool.evict_idle()
+    with _replica_lock:
+        replica = dict(_replica_state)
+    return {
+        "last_successful_host": _last_successful_host,
+        "read_from_replica": Config.DB_READ_FROM_REPLICA,
+        "replica": replica,
+        "pools": [pool.stats() for pool in pools],
+    }
+
+def _check_replica_lag():
     """
-    Obtiene una conexión a la base de datos con failover automático y reintentos.
-    
+    Consulta Seconds_Behind_Master en la réplica.
+
+    Returns:
+        (usable, lag): usable es False si la réplica no responde, no está
+        replicando (réplica promovida o replicación detenida) o su retraso
+        supera DB_REPLICA_MAX_LAG.
+    """
+    try:
+        conn = get_pool(Config.DB_REPLICA_HOST).acquire(timeout=1)
+    except Error as e:
+        logger.warning(f"⚠️  Réplica {Config.DB_REPLICA_HOST} no disponible para lecturas: {e}")
+        return False, None
+
+    try:
+        cur = conn.cursor(dictionary=True)
+        cur.execute("SHOW SLAVE STATUS")
+        row = cur.fetchone()
+        cur.close()
+    except Error as e:
+        logger.warning(f"⚠️  No se pudo leer el estado de replicación: {e}")
+        return False, None
+    finally:
+        conn.close()
+
+    lag = row.get("Seconds_Behind_Master") if row else None
+    if lag is None:
+        return False, None
+    if lag > Config.DB_REPLICA_MAX_LAG:
+        logger.warning(f"⚠️  Réplica atrasada {lag}s (máximo {Config.DB_REPLICA_MAX_LAG}s), leyendo del primary")
+        return False, lag
+    return True, lag
+
+def _replica_usable():
+    """Indica si la réplica puede atender lecturas, con el chequeo de lag cacheado"""
+    now = time.monotonic()
+    with _replica_lock:
+        checked_at = _replica_state["checked_at"]
+        if checked_at is not None and now - checked_at < Config.DB_REPLICA_LAG_CHECK_INTERVAL:
+            return _replica_state["usable"]
+        # Marcar el chequeo antes de hacerlo para que un solo hilo consulte la réplica
+        _replica_state["checked_at"] = now
+
+    usable, lag = _check_replica_lag()
+    with _replica_lock:
+        _replica_state["usable"] = usable
+        _replica_state["lag"] = lag
+    return usable
+
+def _mark_replica_unusable():
+    with _replica_lock:
+        _replica_state["usable"] = False
+        _replica_state["checked_at"] = time.monotonic()
+
+def get_read_connection():
+    """
+    Presta una conexión para consultas de solo lectura.
+
+    Usa la réplica (DB_REPLICA_HOST) si está habilitado DB_READ_FROM_REPLICA,
+    responde y su Seconds_Behind_Master no supera DB_REPLICA_MAX_LAG. En otro
+    caso cae a get_connection(writable=False), que prioriza el primary.
+
+    Returns:
+        PooledConnection si tiene éxito, None si falla
+    """
+    if Config.DB_READ_FROM_REPLICA and Config.DB_REPLICA_HOST != Config.DB_HOST and _replica_usable():
+        try:
+            return get_pool(Config.DB_REPLICA_HOST).acquire()
+        except PoolExhausted:
+            # Réplica ocupada, no caída: la lectura va al primary sin marcarla
+            logger.warning(f"⚠️  Pool de la réplica agotado, leyendo del primary")
+        except Error as e:
+            logger.warning(f"⚠️  Lectura en réplica falló, usando primary: {e}")
+            _mark_replica_unusable()
+
+    return get_connection(writable=False)
+
+def warm_pool(size=None):
+    """
+    Abre `size` conexiones (DB_POOL_WARM por defecto) y las deja ociosas
+    en el pool, para que las primeras peticiones no paguen el handshake.
+    """
+    size = Config.DB_POOL_WARM if size is None else size
+    conns = []
+    try:
+        for _ in range(size):
+            conn = get_connection(max_retries=1)
+            if conn is None:
+                break
+            conns.append(conn)
+    finally:
+        for conn in conns:
+            conn.close()
+    logger.info(f"🔥 Pool pre-calentado con {len(conns)} conexiones")
+    return len(conns)
+
+# Hosts que el failover ya promovió a master (la promoción no se revierte)
+_promoted_hosts = set()
+
+def _is_promoted(host):
+    """
+    Indica si `host` dejó de ser réplica (SHOW SLAVE STATUS vacío), es decir,
+    si el failover lo promovió a master y puede recibir escrituras.
+    """
+    if host in _promoted_hosts:
+        return True
+    conn = get_pool(host).acquire(timeout=1)
+    try:
+        cur = conn.cursor()
+        cur.execute("SHOW SLAVE STATUS")
+        row = cur.fetchone()
+        cur.close()
+    finally:
+        conn.close()
+    if row is None:
+        _promoted_hosts.add(host)
+        logger.info(f"✅ {host} fue promovido a master, se acepta para escrituras")
+        return True
+    return False
+
+def get_connection(max_retries=5, retry_delay=2, writable=True):
+    """
+    Presta una conexión del pool con failover automático y reintentos.
+
     Orden de conexión:
-    1. Intenta conectarse al host primary (DB_HOST)
-    2. Si falla, intenta conectarse al host replica (DB_REPLICA_HOST)
+    1. Intenta con el pool del host primary (DB_HOST)
+    2. Si no responde, intenta con DB_REPLICA_HOST; con writable=True solo
+       si ya fue promovido a master (las escrituras nunca van a una réplica
+       que sigue replicando)
     3. Reintenta hasta max_retries veces con delay entre intentos
-    
+
+    Un pool ocupado no es un host caído: PoolExhausted se propaga al
+    llamador (503) en lugar de provocar failover.
+
+    La conexión devuelta se regresa al pool al llamar a close().
+
     Args:
         max_retries: Número máximo de intentos de conexión
         retry_delay: Segundos de espera entre reintentos
-        
+        writable: False para lecturas, que sí pueden caer a la réplica
+
     Returns:
-        Connection object si tiene éxito, None si falla
+        PooledConnection si tiene éxito, None si falla
+
+    Raises:
+        PoolExhausted: si el pool del host que responde está agotado
     """
     global _last_successful_host
-    
-    # Configuración de hosts
-    primary_host = os.getenv("DB_HOST", "mariadb-master")
-    replica_host = os.getenv("DB_REPLICA_HOST", "mariadb-replica")
-    port = os.getenv("DB_PORT", "3306")
-    user = os.getenv("DB_USER", "appuser")
-    password = os.getenv("DB_PASSWORD", "apppass")
-    database = os.getenv("DB_NAME", "gestion_medica")
-    
+
     # Lista de hosts a intentar (primary primero, luego replica)
-    hosts_to_try = [primary_host, replica_host]
-    
+    hosts_to_try = [Config.DB_HOST, Config.DB_REPLICA_HOST]
+
     # Si tenemos un último host exitoso, intentarlo primero
     if _last_successful_host and _last_successful_host in hosts_to_try:
         hosts_to_try.remove(_last_successful_host)
         hosts_to_try.insert(0, _last_successful_host)
-    
+
     for attempt in range(max_retries):
         for host in hosts_to_try:
             try:
-                logger.info(f"🔌 Intento {attempt + 1}/{max_retries}: Conectando a {host}...")
-                
-                conn = mysql.connector.connect(
-                    host=host,
-                    port=port,
-                    user=user,
-                    password=password,
-                    database=database,
-                    connect_timeout=5
-                )
-                
-                # Verificar que la conexión está activa
-                conn.ping(reconnect=False)
-                
-                # Conexión exitosa
-                _last_successful_host = host
-                logger.info(f"✅ Conectado exitosamente a {host} ({database})")
+                if writable and host != Config.DB_HOST and not _is_promoted(host):
+                    logger.warning(f"⚠️  {host} sigue siendo réplica, no se usa para escrituras")
+                    continue
+
+                conn = get_pool(host).acquire()
+
+                if _last_successful_host != host:
+                    logger.info(f"✅ Conectado exitosamente a {host} ({Config.DB_NAME})")
+                if writable:
+                    # Una lectura servida por la réplica no debe fijar el host de las escrituras
+                    _last_successful_host = host
                 return conn
-                
+
+            except PoolExhausted:
+                raise
             except Error as e:
-                logger.warning(f"⚠️  Conexión a {host} falló: {e}")
+                logger.warning(f"⚠️  Conexión a {host} falló (intento {attempt + 1}/{max_retries}): {e}")
                 continue  # Intentar siguiente host
-        
+
         # Si llegamos aquí, todos los hosts fallaron en este intento
         if attempt < max_retries - 1:
             logger.warning(f"💤 Esperando {retry_delay}s antes del siguiente intento...")
             time.sleep(retry_delay)
-    
+
     # Todos los intentos fallaron
     logger.error(f"❌ No se pudo conectar a ningún host después de {max_retries} intentos")
     logger.error(f"   Hosts intentados: {hosts_to_try}")
     return None
+
+def ids_existentes(cur, tabla, ids):
+    """Retorna el subconjunto de `ids` que existe en `tabla` (cursor sin dictionary)"""
+    if not ids:
+        return set()
+    placeholders = ", ".join(["%s"] * len(ids))
+    cur.execute(f"SELECT id FROM {tabla} WHERE id IN ({placeholders})", tuple(ids))
+    return {row[0] for row in cur.fetchall()}
@@ -0,0 +1,42 @@
+"""
+Configuración de gunicorn para App1 en producción.
+
+Todo se ajusta por variables de entorno:
+    GUNICORN_BIND          Dirección de escucha (default 0.0.0.0:5001)
+    GUNICORN_WORKERS       Procesos worker (default min(2 * CPUs + 1, 4))
+    GUNICORN_WORKER_CLASS  gthread | gevent | sync (default gthread)
+    GUNICORN_THREADS       Hilos por worker con gthread (default 4)
+    GUNICORN_WORKER_CONNECTIONS  Conexiones simultáneas por worker con gevent (default 100)
+    GUNICORN_KEEPALIVE     Segundos de keep-alive HTTP (default 5)
+    GUNICORN_TIMEOUT       Segundos antes de reiniciar un worker colgado (default 60)
+
+Con gthread conviene DB_POOL_SIZE >= GUNICORN_THREADS, y con gevent
+DB_POOL_SIZE acota las consultas simultáneas de cada worker. Con gevent
+mysql-connector usa su implementación en Python puro (DB_USE_PURE se activa
+solo): la extensión C bloquearía el worker completo en cada consulta y los
+greenlets no darían concurrencia. Cada worker
+tiene su propio pool: workers * DB_POOL_SIZE por contenedor debe caber en
+max_connections de MariaDB.
+"""
+import multiprocessing
+import os
+
+bind = os.getenv("GUNICORN_BIND", "0.0.0.0:5001")
+workers = int(os.getenv("GUNICORN_WORKERS", str(min(multiprocessing.cpu_count() * 2 + 1, 4))))
+worker_class = os.getenv("GUNICORN_WORKER_CLASS", "gthread")
+threads = int(os.getenv("GUNICORN_THREADS", "4"))
+worker_connections = int(os.getenv("GUNICORN_WORKER_CONNECTIONS", "100"))
+keepalive = int(os.getenv("GUNICORN_KEEPALIVE", "5"))
+timeout = int(os.getenv("GUNICORN_TIMEOUT", "60"))
+graceful_timeout = 30
+
+accesslog = "-"
+errorlog = "-"
+loglevel = os.getenv("GUNICORN_LOGLEVEL", "info")
+
+
+def post_worker_init(worker):
+    """Abre las primeras conexiones del pool antes de recibir tráfico"""
+    from db import warm_pool
+
+    warm_pool()
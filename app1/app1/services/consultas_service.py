@@ -1,22 +1,157 @@
-from db import get_connection
+import json
+from datetime import datetime
+from config import Config
+from db import get_connection, get_read_connection, ids_existentes
+from utils.response import conditional, make_etag
 
-def listar_consultas_service():
-    conn = get_connection()
+# Columnas que se pueden pedir con ?fields= (id siempre se incluye: es el cursor)
+CONSULTA_FIELDS = (
+    "id", "id_paciente", "id_medico", "fecha", "motivo",
+    "diagnostico", "tratamiento", "estado", "created_at"
+)
+
+def _parse_fields(fields):
+    """Valida la proyección pedida y retorna la lista de columnas"""
+    if not fields:
+        return list(CONSULTA_FIELDS)
+
+    requested = [f.strip() for f in fields.split(",") if f.strip()]
+    invalid = [f for f in requested if f not in CONSULTA_FIELDS]
+    if invalid:
+        raise ValueError(f"Campos no válidos: {', '.join(invalid)}")
+
+    columns = ["id"] + [f for f in requested if f != "id"]
+    return list(dict.fromkeys(columns))
+
+def _parse_fecha(value):
+    """
+    Valida la fecha de una consulta (ISO 8601, p. ej. 2024-05-10 o
+    2024-05-10T15:30:00) y la retorna como datetime para la columna DATETIME.
+
+    Raises:
+        ValueError: si no es una fecha ISO 8601 sin zona horaria
+    """
+    if not isinstance(value, str):
+        raise ValueError("fecha debe ser un texto ISO 8601")
+    try:
+        fecha = datetime.fromisoformat(value.strip())
+    except ValueError:
+        raise ValueError(f"fecha no válida: {value!r} (se espera ISO 8601, p. ej. 2024-05-10T15:30:00)") from None
+    if fecha.tzinfo is not None:
+        raise ValueError("fecha no debe incluir zona horaria")
+    return fecha
+
+def listar_consultas_service(cursor=None, limit=None, fields=None):
+    """
+    Lista consultas paginando por id (keyset): cada página es
+    `WHERE id > cursor ORDER BY id LIMIT n`, con costo constante sin
+    importar la profundidad de la página.
+
+    Args:
+        cursor: id de la última consulta de la página anterior
+        limit: tamaño de página (acotado a CONSULTAS_PAGE_MAX)
+        fields: columnas separadas por coma a retornar
+    """
+    try:
+        cursor = int(cursor) if cursor not in (None, "") else 0
+        limit = int(limit) if limit not in (None, "") else Config.CONSULTAS_PAGE_DEFAULT
+        columns = _parse_fields(fields)
+    except ValueError as e:
+        return {"error": f"Parámetros inválidos: {str(e)}"}, 400
+
+    if limit < 1:
+        return {"error": "Parámetros inválidos: limit debe ser mayor que 0"}, 400
+    limit = min(limit, Config.CONSULTAS_PAGE_MAX)
+
+    conn = get_read_connection()
     if conn is None:
         return {"error": "No se pudo conectar a la base de datos"}, 503
     
     try:
         cur = conn.cursor(dictionary=True)
-        cur.execute("SELECT * FROM consultas")
+        # Se pide una fila extra para saber si hay página siguiente
+        sql = f"SELECT {', '.join(columns)} FROM consultas WHERE id > %s ORDER BY id LIMIT %s"
+        cur.execute(sql, (cursor, limit + 1))
         rows = cur.fetchall()
-        return {"consultas": rows}, 200
+
+        has_more = len(rows) > limit
+        rows = rows[:limit]
+        next_cursor = rows[-1]["id"] if has_more else None
+        return {"consultas": rows, "next_cursor": next_cursor, "limit": limit}, 200
     except Exception as e:
         return {"error": f"Error al consultar: {str(e)}"}, 500
     finally:
         if conn:
             conn.close()
 
+class ConsultasExport:
+    """
+    Iterable de líneas NDJSON sobre un cursor sin buffer.
+
+    Lee de a CONSULTAS_EXPORT_CHUNK filas con fetchmany(), de modo que la
+    memoria del worker no depende del tamaño de la tabla. close() (que el
+    servidor WSGI llama al terminar o cortarse la respuesta, aunque no se
+    haya iterado) devuelve la conexión al pool
+    si se leyó todo, o la descarta si quedaron filas sin leer en el socket.
+    """
+
+    def __init__(self, conn, cur):
+        self.conn = conn
+        self.cur = cur
+        self.finished = False
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        rows = self.cur.fetchmany(Config.CONSULTAS_EXPORT_CHUNK)
+        if not rows:
+            self.finished = True
+            raise StopIteration
+        return "".join(json.dumps(row, default=str) + "\n" for row in rows)
+
+    def close(self):
+        """Libera la conexión (idempotente)"""
+        if self.finished:
+            self.cur.close()
+            self.conn.close()
+        else:
+            self.conn.discard()
+
+def exportar_consultas_service(fields=None):
+    """
+    Prepara la exportación completa de consultas en NDJSON.
+
+    Returns:
+        (ConsultasExport, 200) listo para enviarse como streaming, o
+        (dict de error, código) si falla antes de empezar a enviar
+    """
+    try:
+        columns = _parse_fields(fields)
+    except ValueError as e:
+        return {"error": f"Parámetros inválidos: {str(e)}"}, 400
+
+    conn = get_read_connection()
+    if conn is None:
+        return {"error": "No se pudo conectar a la base de datos"}, 503
+
+    try:
+        # Cursor sin buffer: las filas se leen del servidor a medida que se envían
+        cur = conn.cursor(dictionary=True, buffered=False)
+        cur.execute(f"SELECT {', '.join(columns)} FROM consultas ORDER BY id")
+        return ConsultasExport(conn, cur), 200
+    except Exception as e:
+        conn.discard()
+        return {"error": f"Error al exportar: {str(e)}"}, 500
+
 def registrar_consulta_service(data):
+    try:
+        fecha = _parse_fecha(data["fecha"])
+    except (KeyError, TypeError):
+        return {"error": "Falta el campo fecha"}, 400
+    except ValueError as e:
+        return {"error": str(e)}, 400
+
     conn = get_connection()
     if conn is None:
         return {"error": "No se pudo conectar a la base de datos"}, 503
@@ -30,7 +165,7 @@ def registrar_consulta_service(data):
         cur.execute(sql, (
             data["id_paciente"],
             data["id_medico"],
-            data["fecha"],
+            fecha,
             data.get("motivo"),
             data.get("diagnostico"),
             data.get("tratamiento")
@@ -43,29 +178,150 @@ def registrar_consulta_service(data):
         if conn:
             conn.close()
 
-def historial_paciente_service(identifier):
-    conn = get_connection()
+def registrar_consultas_bulk_service(data):
+    """
+    Registra un lote de consultas en una sola transacción con executemany.
+
+    Cada fila se valida (campos obligatorios, fecha, paciente y médico existentes)
+    antes de insertar; las filas inválidas se informan en `results` y no
+    impiden insertar las demás.
+
+    Returns:
+        201 si se insertaron todas, 207 si solo algunas, 400 si ninguna
+    """
+    if not isinstance(data, list):
+        return {"error": "Se esperaba un arreglo JSON de consultas"}, 400
+    if not data:
+        return {"error": "El lote está vacío"}, 400
+    if len(data) > Config.CONSULTAS_BULK_MAX:
+        return {"error": f"El lote excede el máximo de {Config.CONSULTAS_BULK_MAX} consultas"}, 413
+
+    results = [None] * len(data)
+    candidatas = []
+    for i, item in enumerate(data):
+        if not isinstance(item, dict):
+            results[i] = {"index": i, "status": "error", "error": "La consulta debe ser un objeto"}
+            continue
+        faltantes = [campo for campo in ("id_paciente", "id_medico", "fecha") if not item.get(campo)]
+        if faltantes:
+            results[i] = {"index": i, "status": "error", "error": f"Faltan campos: {', '.join(faltantes)}"}
+            continue
+        try:
+            id_paciente, id_medico = int(item["id_paciente"]), int(item["id_medico"])
+        except (TypeError, ValueError):
+            results[i] = {"index": i, "status": "error", "error": "id_paciente e id_medico deben ser enteros"}
+            continue
+        try:
+            fecha = _parse_fecha(item["fecha"])
+        except ValueError as e:
+            results[i] = {"index": i, "status": "error", "error": str(e)}
+            continue
+        candidatas.append((i, id_paciente, id_medico, fecha, item))
+
+    inserted = 0
+    if candidatas:
+        conn = get_connection()
+        if conn is None:
+            return {"error": "No se pudo conectar a la base de datos"}, 503
+
+        try:
+            cur = conn.cursor()
+            pacientes = ids_existentes(cur, "pacientes", {c[1] for c in candidatas})
+            medicos = ids_existentes(cur, "medicos", {c[2] for c in candidatas})
+
+            filas = []
+            for i, id_paciente, id_medico, fecha, item in candidatas:
+                if id_paciente not in pacientes:
+                    results[i] = {"index": i, "status": "error", "error": f"Paciente {id_paciente} no existe"}
+                elif id_medico not in medicos:
+                    results[i] = {"index": i, "status": "error", "error": f"Médico {id_medico} no existe"}
+                else:
+                    filas.append((
+                        id_paciente,
+                        id_medico,
+                        fecha,
+                        item.get("motivo"),
+                        item.get("diagnostico"),
+                        item.get("tratamiento")
+                    ))
+                    results[i] = {"index": i, "status": "created"}
+
+            if filas:
+                sql = """
+                    INSERT INTO consultas (id_paciente, id_medico, fecha, motivo, diagnostico, tratamiento)
+                    VALUES (%s, %s, %s, %s, %s, %s)
+                """
+                cur.executemany(sql, filas)
+                conn.commit()
+                inserted = len(filas)
+        except Exception as e:
+            conn.rollback()
+            return {"error": f"Error al registrar lote: {str(e)}"}, 500
+        finally:
+            conn.close()
+
+    if inserted == len(data):
+        status = 201
+    elif inserted:
+        status = 207
+    else:
+        status = 400
+
+    return {
+        "total": len(data),
+        "inserted": inserted,
+        "failed": len(data) - inserted,
+        "results": results
+    }, status
+
+def historial_paciente_service(identifier, if_none_match=None):
+    """
+    Historial de consultas de un paciente por id o RUT.
+
+    Responde con ETag calculado a partir de COUNT(*) y MAX(id) de sus
+    consultas (las consultas solo se insertan vía API). Si el cliente envía
+    ese ETag en If-None-Match se responde 304 sin ejecutar el JOIN completo;
+    el fingerprint se resuelve sobre idx_consultas_paciente_fecha.
+    """
+    conn = get_read_connection()
     if conn is None:
         return {"error": "No se pudo conectar a la base de datos"}, 503
     
     try:
         cur = conn.cursor(dictionary=True)
         
-        # Query joining with pacientes (to filter by RUT) and medicos (to get details)
-        sql = """
+        # Un identificador numérico es el id del paciente; cualquier otro es su RUT.
+        # Cada caso usa su propio índice (idx_consultas_paciente_fecha o el UNIQUE de rut)
+        # en lugar de un OR entre columnas de distinto tipo.
+        identifier = str(identifier).strip()
+        if identifier.isdigit():
+            from_clause = "FROM consultas c"
+            where_clause = "WHERE c.id_paciente = %s"
+            param = int(identifier)
+        else:
+            from_clause = "FROM pacientes p JOIN consultas c ON c.id_paciente = p.id"
+            where_clause = "WHERE p.rut = %s"
+            param = identifier
+
+        cur.execute(
+            f"SELECT COUNT(*) AS total, MAX(c.id) AS max_id {from_clause} {where_clause}",
+            (param,)
+        )
+        fingerprint = cur.fetchone()
+        etag = make_etag("historial", identifier, fingerprint["total"], fingerprint["max_id"])
+        if if_none_match is not None and if_none_match.contains(etag):
+            return conditional(None, etag, if_none_match)
+
+        sql = f"""
             SELECT c.*, m.nombre as nombre_medico, m.especialidad 
-            FROM consultas c
-            JOIN pacientes p ON c.id_paciente = p.id
+            {from_clause}
             LEFT JOIN medicos m ON c.id_medico = m.id
-            WHERE p.rut = %s OR p.id = %s
+            {where_clause}
+            ORDER BY c.fecha DESC
         """
-        # Try to use identifier as both RUT and ID (if it's a number)
-        # This covers both cases: passed as RUT string or ID integer
-        param = identifier
-        
-        cur.execute(sql, (param, param))
+        cur.execute(sql, (param,))
         rows = cur.fetchall()
-        return {"consultas": rows}, 200
+        return conditional({"consultas": rows}, etag)
     except Exception as e:
         return {"error": f"Error al obtener historial: {str(e)}"}, 500
     finally:
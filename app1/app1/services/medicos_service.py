@@ -1,7 +1,34 @@
-from db import get_connection
+from config import Config
+from db import get_connection, get_read_connection, ids_existentes
+from utils.cache import TTLCache
+from utils.response import conditional, make_etag
 
-def listar_medicos_service():
-    conn = get_connection()
+# Listado de médicos cacheado; se invalida al actualizar disponibilidad
+MEDICOS_KEY = "medicos"
+medicos_cache = TTLCache(Config.MEDICOS_CACHE_TTL)
+
+def _parse_disponible(value):
+    """
+    Valida el flag `disponible`: solo true/false o 0/1 (un texto como
+    "false" no es falso). Retorna 0 o 1.
+
+    Raises:
+        ValueError: si no es booleano ni 0/1
+    """
+    if isinstance(value, bool) or (isinstance(value, int) and value in (0, 1)):
+        return int(value)
+    raise ValueError(f"disponible debe ser true/false o 0/1, no {value!r}")
+
+def listar_medicos_service(if_none_match=None):
+    cached = medicos_cache.get(MEDICOS_KEY)
+    if cached is not None:
+        body, etag = cached
+        return conditional(body, etag, if_none_match)
+
+    version = medicos_cache.version(MEDICOS_KEY)
+    # Con caché activa el relleno va al primary: leer de una réplica atrasada justo
+    # después de una invalidación volvería a cachear la disponibilidad anterior
+    conn = get_connection() if medicos_cache.ttl > 0 else get_read_connection()
     if conn is None:
         return {"error": "No se pudo conectar a la base de datos"}, 503
     
@@ -9,7 +36,11 @@ def listar_medicos_service():
         cur = conn.cursor(dictionary=True)
         cur.execute("SELECT * FROM medicos")
         rows = cur.fetchall()
-        return {"medicos": rows}, 200
+        body = {"medicos": rows, "version": version}
+        # El ETag sale del contenido, no de la versión: la versión es por worker
+        etag = make_etag(rows)
+        medicos_cache.set(MEDICOS_KEY, (body, etag), version=version)
+        return conditional(body, etag, if_none_match)
     except Exception as e:
         return {"error": f"Error al consultar: {str(e)}"}, 500
     finally:
@@ -17,6 +48,13 @@ def listar_medicos_service():
             conn.close()
 
 def actualizar_disponibilidad_service(data):
+    try:
+        disponible = _parse_disponible(data["disponible"])
+    except (TypeError, KeyError):
+        return {"error": "Falta el campo disponible"}, 400
+    except ValueError as e:
+        return {"error": str(e)}, 400
+
     conn = get_connection()
     if conn is None:
         return {"error": "No se pudo conectar a la base de datos"}, 503
@@ -24,8 +62,9 @@ def actualizar_disponibilidad_service(data):
     try:
         cur = conn.cursor()
         sql = "UPDATE medicos SET disponible=%s WHERE id=%s"
-        cur.execute(sql, (data["disponible"], data["id_medico"]))
+        cur.execute(sql, (disponible, data["id_medico"]))
         conn.commit()
+        medicos_cache.invalidate(MEDICOS_KEY)
         
         if cur.rowcount == 0:
             return {"error": "Médico no encontrado"}, 404
@@ -36,3 +75,61 @@ def actualizar_disponibilidad_service(data):
     finally:
         if conn:
             conn.close()
+
+def actualizar_disponibilidad_bulk_service(data):
+    """
+    Actualiza la disponibilidad de varios médicos con un solo
+    UPDATE ... CASE en una transacción.
+
+    Args:
+        data: arreglo de {"id_medico": int, "disponible": bool o 0|1}; si un médico
+              se repite, gana la última entrada
+
+    Returns:
+        200 con los ids actualizados y los no encontrados
+    """
+    if not isinstance(data, list) or not data:
+        return {"error": "Se esperaba un arreglo JSON no vacío"}, 400
+    if len(data) > Config.MEDICOS_BULK_MAX:
+        return {"error": f"El lote excede el máximo de {Config.MEDICOS_BULK_MAX} médicos"}, 413
+
+    cambios = {}
+    for i, item in enumerate(data):
+        try:
+            id_medico = int(item["id_medico"])
+            disponible = item["disponible"]
+        except (TypeError, KeyError, ValueError):
+            return {"error": f"Elemento {i}: se requiere id_medico entero y disponible"}, 400
+        try:
+            cambios[id_medico] = _parse_disponible(disponible)
+        except ValueError as e:
+            return {"error": f"Elemento {i}: {e}"}, 400
+
+    conn = get_connection()
+    if conn is None:
+        return {"error": "No se pudo conectar a la base de datos"}, 503
+    
+    try:
+        cur = conn.cursor()
+        existentes = ids_existentes(cur, "medicos", cambios.keys())
+        ids = sorted(existentes)
+
+        if ids:
+            casos = " ".join(["WHEN %s THEN %s"] * len(ids))
+            placeholders = ", ".join(["%s"] * len(ids))
+            sql = f"UPDATE medicos SET disponible = CASE id {casos} END WHERE id IN ({placeholders})"
+            params = [v for id_medico in ids for v in (id_medico, cambios[id_medico])] + ids
+            cur.execute(sql, params)
+            conn.commit()
+            medicos_cache.invalidate(MEDICOS_KEY)
+
+        return {
+            "msg": "Disponibilidad actualizada",
+            "updated": ids,
+            "not_found": sorted(set(cambios) - existentes)
+        }, 200
+    except Exception as e:
+        conn.rollback()
+        return {"error": f"Error al actualizar: {str(e)}"}, 500
+    finally:
+        conn.close()
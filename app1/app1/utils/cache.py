@@ -0,0 +1,66 @@
+import time
+import threading
+
+
+class TTLCache:
+    """
+    Caché en memoria con expiración por entrada y contador de versión por clave.
+
+    La versión sube en cada invalidación; set() recibe la versión leída antes
+    de ir a la base de datos y descarta el valor si hubo una invalidación en
+    el medio, para no volver a cachear datos anteriores a una escritura.
+
+    La caché es por proceso: con varios workers de gunicorn, una invalidación
+    solo afecta al worker que atendió la escritura y los demás se ponen al día
+    al vencer el TTL.
+    """
+
+    def __init__(self, ttl):
+        self.ttl = ttl
+        self._entries = {}  # clave -> (valor, instante de expiración)
+        self._versions = {}
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+
+    def get(self, key):
+        """Retorna el valor vigente o None"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[1] > time.monotonic():
+                self._hits += 1
+                return entry[0]
+            self._entries.pop(key, None)
+            self._misses += 1
+            return None
+
+    def set(self, key, value, version=None):
+        """Guarda un valor si la clave no fue invalidada desde `version`"""
+        if self.ttl <= 0:
+            return False
+        with self._lock:
+            if version is not None and version != self._versions.get(key, 0):
+                return False
+            self._entries[key] = (value, time.monotonic() + self.ttl)
+            return True
+
+    def version(self, key):
+        with self._lock:
+            return self._versions.get(key, 0)
+
+    def invalidate(self, key):
+        """Descarta la entrada y sube su versión"""
+        with self._lock:
+            self._entries.pop(key, None)
+            self._versions[key] = self._versions.get(key, 0) + 1
+            return self._versions[key]
+
+    def stats(self):
+        with self._lock:
+            return {
+                "ttl": self.ttl,
+                "entries": len(self._entries),
+                "hits": self._hits,
+                "misses": self._misses,
+                "versions": dict(self._versions),
+            }
@@ -0,0 +1,22 @@
+import hashlib
+import json
+
+
+def make_etag(*parts):
+    """ETag fuerte a partir de un fingerprint serializable (filas, contadores, versiones)"""
+    raw = json.dumps(parts, sort_keys=True, default=str).encode("utf-8")
+    return hashlib.sha1(raw).hexdigest()
+
+
+def conditional(body, etag, if_none_match=None):
+    """
+    Respuesta condicional: 304 sin cuerpo si el cliente ya tiene `etag`
+    (If-None-Match), o el cuerpo con su ETag en otro caso.
+
+    Args:
+        if_none_match: request.if_none_match (werkzeug ETags) o None
+    """
+    headers = {"ETag": f'"{etag}"', "Cache-Control": "no-cache"}
+    if if_none_match is not None and if_none_match.contains(etag):
+        return "", 304, headers
+    return body, 200, headers
@@ -29,6 +29,8 @@ CREATE TABLE IF NOT EXISTS consultas (
     tratamiento TEXT,
     estado ENUM('pendiente','realizada','cancelada') DEFAULT 'pendiente',
     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    -- Historial por paciente ordenado por fecha sin filesort (también cubre la FK de id_paciente)
+    INDEX idx_consultas_paciente_fecha (id_paciente, fecha),
     FOREIGN KEY (id_paciente) REFERENCES pacientes(id),
     FOREIGN KEY (id_medico) REFERENCES medicos(id)
 );
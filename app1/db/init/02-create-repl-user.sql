@@ -1,3 +1,7 @@
 CREATE USER 'repl'@'%' IDENTIFIED BY 'replpass';
 GRANT REPLICATION SLAVE ON *.* TO 'repl'@'%';
 FLUSH PRIVILEGES;
+
+-- Permite a App1 leer Seconds_Behind_Master para decidir si enviar lecturas a la réplica
+GRANT SLAVE MONITOR ON *.* TO 'appuser'@'%';
+FLUSH PRIVILEGES;
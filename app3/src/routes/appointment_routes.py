@@ -93,6 +93,7 @@ def create_appointment():
             'motivo': data.get('notes', ''),
             'diagnostico': '',  # Pendiente
             'tratamiento': '',  # Pendiente
+            'patient_rut': data.get('patient_rut'),
         }
         
         consultation = middleware.create_consultation(consultation_data)
@@ -27,7 +27,7 @@ def login():
             # Intentar obtener el paciente desde App2 vía middleware
             url = f"{Config.MIDDLEWARE_URL}/api/patient/{rut}"
             import requests
-            response = requests.get(url, timeout=5)
+            response = requests.get(url, timeout=middleware.timeout, headers=middleware.deadline_headers())
             
             if response.status_code == 200:
                 # El paciente existe, permitir login
@@ -4,6 +4,10 @@ import logging
 
 logger = logging.getLogger(__name__)
 
+# Milisegundos que App3 está dispuesto a esperar; el middleware no sigue
+# trabajando (ni llamando a App1/App2) más allá de ese plazo
+DEADLINE_HEADER = "X-Request-Deadline-Ms"
+
 class MiddlewareClient:
     """Cliente para comunicarse con el Middleware"""
     
@@ -11,11 +15,15 @@ class MiddlewareClient:
         self.base_url = base_url
         self.timeout = 5  # segundos
     
+    def deadline_headers(self) -> Dict[str, str]:
+        """Headers con el deadline de la petición (igual al timeout del cliente)"""
+        return {DEADLINE_HEADER: str(int(self.timeout * 1000))}
+    
     def get_patient_medical_history(self, patient_rut: str) -> Optional[Dict]:
         """Obtiene el historial médico del paciente desde App1 vía Middleware"""
         try:
             url = f"{self.base_url}/api/medical-history/{patient_rut}"
-            response = requests.get(url, timeout=self.timeout)
+            response = requests.get(url, timeout=self.timeout, headers=self.deadline_headers())
             response.raise_for_status()
             return response.json()
         except requests.exceptions.RequestException as e:
@@ -27,7 +35,7 @@ class MiddlewareClient:
         """Obtiene información de pagos del paciente desde App2 vía Middleware"""
         try:
             url = f"{self.base_url}/api/payments/{patient_rut}"
-            response = requests.get(url, timeout=self.timeout)
+            response = requests.get(url, timeout=self.timeout, headers=self.deadline_headers())
             response.raise_for_status()
             return response.json()
         except requests.exceptions.RequestException as e:
@@ -40,7 +48,7 @@ class MiddlewareClient:
         try:
             url = f"{self.base_url}/api/doctors"
             params = {'specialty': specialty} if specialty else {}
-            response = requests.get(url, params=params, timeout=self.timeout)
+            response = requests.get(url, params=params, timeout=self.timeout, headers=self.deadline_headers())
             response.raise_for_status()
             return response.json()
         except requests.exceptions.RequestException as e:
@@ -145,7 +153,7 @@ class MiddlewareClient:
         try:
             # Primero intentar obtener el paciente por RUT
             url = f"{self.base_url}/api/patient/{patient_data['rut']}"
-            response = requests.get(url, timeout=self.timeout)
+            response = requests.get(url, timeout=self.timeout, headers=self.deadline_headers())
             
             if response.status_code == 200:
                 # Paciente existe, retornar sus datos
@@ -156,7 +164,7 @@ class MiddlewareClient:
                 # Paciente no existe, registrarlo
                 logger.info(f"Paciente no encontrado, registrando: {patient_data['rut']}")
                 url_create = f"{self.base_url}/api/patients"
-                response_create = requests.post(url_create, json=patient_data, timeout=self.timeout)
+                response_create = requests.post(url_create, json=patient_data, timeout=self.timeout, headers=self.deadline_headers())
                 response_create.raise_for_status()
                 new_patient = response_create.json()
                 logger.info(f"Paciente creado exitosamente: {patient_data['rut']} (ID: {new_patient.get('id')})")
@@ -191,10 +199,11 @@ class MiddlewareClient:
                 "diagnosis": consultation_data.get('diagnostico', consultation_data.get('diagnosis', '')),
                 "treatment": consultation_data.get('tratamiento', consultation_data.get('treatment', '')),
                 "notes": consultation_data.get('motivo', consultation_data.get('notes', '')),
-                "fecha": consultation_data.get('fecha', consultation_data.get('appointment_date', ''))
+                "fecha": consultation_data.get('fecha', consultation_data.get('appointment_date', '')),
+                "patient_rut": consultation_data.get('patient_rut')
             }
             
-            response = requests.post(url, json=data, timeout=self.timeout)
+            response = requests.post(url, json=data, timeout=self.timeout, headers=self.deadline_headers())
             response.raise_for_status()
             result = response.json()
             logger.info(f"Consulta creada exitosamente para paciente {data['patient_id']}")
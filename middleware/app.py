@@ -1,8 +1,15 @@
 from fastapi import FastAPI
+from fastapi.responses import JSONResponse, PlainTextResponse
 from fastapi.middleware.cors import CORSMiddleware
-from routes.medical_routes import router as medical_router
-from routes.administrative_routes import router as administrative_router
+from routes.medical_routes import router as medical_router, app1_client
+from routes.administrative_routes import router as administrative_router, app2_client
 from utils.circuit_breaker import circuit_breakers
+from utils.response_cache import response_cache
+from utils.last_known_good import last_known_good
+from utils.request_context import RequestContextMiddleware
+from utils.retry import retry_budget_stats, retry_stats
+from utils.concurrency_limiter import Overloaded, limiters
+from utils.metrics import registry
 import logging
 
 # Configurar logging
@@ -29,10 +36,35 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Ruta y deadline de cada petición en contexto (métricas por ruta, propagación de deadline)
+app.add_middleware(RequestContextMiddleware)
+
 # Registrar routers
 app.include_router(medical_router)
 app.include_router(administrative_router)
 
+@app.exception_handler(Overloaded)
+async def overloaded_handler(request, exc: Overloaded):
+    """Llamada descartada por el limitador de concurrencia del upstream"""
+    return JSONResponse(
+        status_code=503,
+        content={"detail": str(exc)},
+        headers={"Retry-After": str(exc.retry_after)}
+    )
+
+@app.on_event("startup")
+async def startup():
+    """Abre los pools HTTP compartidos hacia App1 y App2"""
+    await app1_client.start()
+    await app2_client.start()
+
+@app.on_event("shutdown")
+async def shutdown():
+    """Cierra los pools HTTP compartidos y persiste las últimas respuestas buenas"""
+    await app1_client.close()
+    await app2_client.close()
+    last_known_good.close()
+
 @app.get("/")
 async def root():
     """Endpoint raíz"""
@@ -61,12 +93,114 @@ async def status():
         "service": "middleware",
         "status": "running",
         "circuit_breakers": {
-            name: {
-                "state": cb.get_state(),
-                "failure_count": cb.failure_count
-            }
+            name: cb.stats()
             for name, cb in circuit_breakers.items()
+        },
+        "http_pools": {
+            "app1": app1_client.pool_stats(),
+            "app2": app2_client.pool_stats()
+        },
+        "caches": {
+            "patients": app2_client.patient_cache.stats(),
+            "responses": response_cache.stats(),
+            "last_known_good": last_known_good.stats()
+        },
+        "singleflight": {
+            "app1": app1_client.singleflight.stats(),
+            "app2": app2_client.singleflight.stats()
+        },
+        "retries": retry_budget_stats(),
+        "bulkheads": {
+            "app1": app1_client.bulkhead.stats(),
+            "app2": app2_client.bulkhead.stats()
+        },
+        "concurrency_limits": {
+            name: limiter.stats()
+            for name, limiter in limiters.items()
+        },
+        "load_balancing": {
+            "app1": app1_client.balancer.stats()
+        },
+        "hedging": {
+            "app1": app1_client.hedger.stats()
         }
     }
 
+# Familias calculadas en cada scrape a partir de las estadísticas de los componentes
+def _cache_lookups():
+    caches = {
+        "patients": app2_client.patient_cache.stats(),
+        "responses": response_cache.stats(),
+        "last_known_good": last_known_good.stats()
+    }
+    results = {
+        "patients": ("hits", "negative_hits", "misses"),
+        "responses": ("hits", "stale_hits", "misses"),
+        "last_known_good": ("hits", "spill_hits", "misses")
+    }
+    for cache, keys in results.items():
+        for result in keys:
+            yield {"cache": cache, "result": result}, caches[cache][result]
+
+def _pool_connections():
+    for upstream, client in (("app1", app1_client), ("app2", app2_client)):
+        for instance, pool in client.pool_stats().items():
+            for state in ("active", "idle"):
+                yield {"upstream": upstream, "instance": instance, "state": state}, pool[state]
+
+def _breaker_state():
+    for name, cb in circuit_breakers.items():
+        for state in ("closed", "open", "half_open"):
+            yield {"breaker": name, "state": state}, 1 if cb.get_state() == state else 0
+
+def _breaker_transitions():
+    for name, cb in circuit_breakers.items():
+        for transition, count in dict(cb.transitions).items():
+            source, target = transition.split("->")
+            yield {"breaker": name, "from": source, "to": target}, count
+
+def _retries():
+    for route, stats in list(retry_stats.items()):
+        for outcome in ("retries", "not_retryable", "budget_exhausted", "deadline_exceeded", "exhausted"):
+            yield {"route": route, "outcome": outcome}, stats[outcome]
+
+def _upstream_in_flight():
+    for upstream, client in (("app1", app1_client), ("app2", app2_client)):
+        yield {"upstream": upstream, "stage": "bulkhead_active"}, client.bulkhead.active
+        yield {"upstream": upstream, "stage": "bulkhead_waiting"}, client.bulkhead.waiting
+    for name, limiter in limiters.items():
+        stats = limiter.stats()
+        yield {"upstream": name, "stage": "admitted"}, stats["in_flight"]
+        yield {"upstream": name, "stage": "queued"}, stats["queued_now"]
+
+def _limiter_limit():
+    for name, limiter in limiters.items():
+        yield {"upstream": name}, int(limiter.limit)
+
+def _shed():
+    for name, limiter in limiters.items():
+        yield {"upstream": name, "by": "concurrency_limit"}, limiter.stats()["shed"]
+    for upstream, client in (("app1", app1_client), ("app2", app2_client)):
+        yield {"upstream": upstream, "by": "bulkhead"}, client.bulkhead.rejected
+
+def _hedges():
+    stats = app1_client.hedger.stats()
+    for outcome in ("requests", "hedged", "hedge_wins"):
+        yield {"upstream": "app1", "outcome": outcome}, stats[outcome]
+
+registry.collector("middleware_cache_lookups_total", "counter", "Consultas a las cachés por resultado", _cache_lookups)
+registry.collector("middleware_http_pool_connections", "gauge", "Conexiones HTTP hacia App1/App2 por estado", _pool_connections)
+registry.collector("middleware_circuit_breaker_state", "gauge", "Estado actual de cada circuit breaker (1 = activo)", _breaker_state)
+registry.collector("middleware_circuit_breaker_transitions_total", "counter", "Transiciones de estado de los circuit breakers", _breaker_transitions)
+registry.collector("middleware_retries_total", "counter", "Reintentos y motivos para no reintentar, por ruta", _retries)
+registry.collector("middleware_upstream_in_flight", "gauge", "Llamadas upstream en curso o en espera", _upstream_in_flight)
+registry.collector("middleware_concurrency_limit", "gauge", "Límite de concurrencia adaptativo actual", _limiter_limit)
+registry.collector("middleware_shed_total", "counter", "Peticiones descartadas por sobrecarga", _shed)
+registry.collector("middleware_hedge_requests_total", "counter", "Lecturas con cobertura hacia App1", _hedges)
+
+@app.get("/metrics")
+async def metrics():
+    """Métricas en formato de texto de Prometheus"""
+    return PlainTextResponse(registry.render(), media_type="text/plain; version=0.0.4")
+
 logger.info("Middleware iniciado correctamente")
@@ -1,12 +1,29 @@
+import asyncio
+import time
 import httpx
-from typing import Dict, List, Optional
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
 from config import settings
 from utils.circuit_breaker import get_circuit_breaker
 from utils.retry import retry_with_backoff
+from utils.http_client import create_http_client, http_pool_stats
+from utils.singleflight import SingleFlight
+from utils.bulkhead import Bulkhead, BulkheadFull
+from utils.concurrency_limiter import Overloaded, get_limiter
+from utils.hedging import Hedger
+from utils.load_balancer import Endpoint, LoadBalancer, is_endpoint_failure
+from utils.errors import CircuitOpenError, DeadlineExceeded, UpstreamUnavailable
+from utils.last_known_good import last_known_good
+from utils.request_context import attempt_timeout, deadline_headers
 import logging
 
 logger = logging.getLogger(__name__)
 
+# Errores que no dicen nada de la salud del upstream: llamada cancelada,
+# llamador sin tiempo, bulkhead local lleno o limitador de concurrencia.
+# Liberan la sonda del circuit breaker sin registrar éxito ni fallo
+_NO_VERDICT_ERRORS = (asyncio.CancelledError, DeadlineExceeded, BulkheadFull, Overloaded)
+
 class App1Client:
     """Cliente HTTP para comunicarse con App1 (Gestión Médica)"""
     
@@ -15,23 +32,192 @@ class App1Client:
         self.replica_url = settings.APP1_REPLICA_URL
         self.timeout = settings.REQUEST_TIMEOUT
         self.circuit_breaker = get_circuit_breaker("app1")
+        # Un httpx.AsyncClient compartido por host; se abren en el startup de FastAPI
+        self._http: Dict[str, httpx.AsyncClient] = {}
+        # URL -> (ETag, cuerpo) de las últimas respuestas GET, en orden LRU
+        self._validators: OrderedDict = OrderedDict()
+        # Compartimento propio: un APP1 lento no agota cupos ni sockets del otro upstream
+        self.bulkhead = Bulkhead(
+            "app1",
+            max_concurrent=settings.APP1_BULKHEAD_MAX_CONCURRENT,
+            max_queue=settings.APP1_BULKHEAD_MAX_QUEUE,
+            queue_timeout=settings.BULKHEAD_QUEUE_TIMEOUT
+        )
+        # Límite adaptativo de llamadas HTTP reales a App1 (no cuenta aciertos de caché)
+        self.limiter = get_limiter("app1")
+        # GETs idénticos concurrentes comparten una sola petición upstream
+        self.singleflight = SingleFlight("app1")
+        # Las lecturas se reparten entre primary, réplica e instancias extra
+        extra_urls = [url.strip() for url in settings.APP1_EXTRA_URLS.split(",") if url.strip()]
+        self.balancer = LoadBalancer(
+            "app1",
+            [self.base_url, self.replica_url, *extra_urls],
+            available=lambda target: self.endpoint_breakers[target.url].accepts()
+        )
+        # Un circuit breaker por instancia, además del general de App1
+        self.endpoint_breakers = {
+            target.url: get_circuit_breaker(self._breaker_name(index, target.url))
+            for index, target in enumerate(self.balancer.endpoints)
+        }
+        self.replica_target = next(
+            target for target in self.balancer.endpoints if target.url == self.replica_url
+        )
+        # Lecturas lentas se cubren con otra instancia
+        self.hedger = Hedger("app1")
+    
+    async def start(self):
+        """Abre los clientes HTTP compartidos (startup de FastAPI)"""
+        for target in self.balancer.endpoints:
+            self._client_for(target.url)
+    
+    async def close(self):
+        """Cierra los clientes HTTP compartidos (shutdown de FastAPI)"""
+        for client in self._http.values():
+            await client.aclose()
+        self._http.clear()
+    
+    def _client_for(self, base_url: str) -> httpx.AsyncClient:
+        """Cliente HTTP compartido del host; se crea al primer uso si no existe"""
+        client = self._http.get(base_url)
+        if client is None or client.is_closed:
+            client = self._http[base_url] = create_http_client(
+                max_connections=settings.APP1_MAX_CONNECTIONS,
+                metrics_labels=("app1", base_url)
+            )
+        return client
+    
+    def pool_stats(self) -> Dict:
+        """Ocupación de los pools HTTP por host"""
+        return {url: http_pool_stats(client) for url, client in self._http.items()}
+    
+    async def _make_request(self, endpoint: str, method: str = "GET", data: Optional[Dict] = None, use_replica: bool = False, base_url: Optional[str] = None, with_status: bool = False):
+        """
+        Realiza una petición HTTP con manejo de errores.
+        Con `with_status` retorna (código, cuerpo) y solo lanza en 5xx, para
+        escrituras cuyo 4xx trae un resultado que el llamador debe ver.
+        """
+        base_url = base_url or (self.replica_url if use_replica else self.base_url)
+        url = f"{base_url}{endpoint}"
+        client = self._client_for(base_url)
+        
+        if method == "GET":
+            return await self.singleflight.do(url, lambda: self._conditional_get(client, url))
+        
+        async with self.limiter.slot():
+            async with self.bulkhead:
+                # Cada intento dura a lo más lo que le queda al llamador
+                timeout = attempt_timeout()
+                headers = deadline_headers(timeout)
+                if method == "POST":
+                    response = await client.post(url, json=data, timeout=timeout, headers=headers)
+                elif method == "PUT":
+                    response = await client.put(url, json=data, timeout=timeout, headers=headers)
+                else:
+                    raise ValueError(f"Método HTTP no soportado: {method}")
+            if not (with_status and response.status_code < 500):
+                response.raise_for_status()
+        
+        if with_status:
+            try:
+                return response.status_code, response.json()
+            except ValueError:
+                return response.status_code, {"error": response.text}
+        return response.json()
+    
+    def _breaker_name(self, index: int, url: str) -> str:
+        if index == 0:
+            return "app1:primary"
+        if url == self.replica_url:
+            return "app1:replica"
+        return f"app1:instance-{index}"
     
-    async def _make_request(self, endpoint: str, method: str = "GET", data: Optional[Dict] = None, use_replica: bool = False) -> Dict:
-        """Realiza una petición HTTP con manejo de errores"""
-        url = f"{self.replica_url if use_replica else self.base_url}{endpoint}"
-        
-        async with httpx.AsyncClient(timeout=self.timeout) as client:
-            if method == "GET":
-                response = await client.get(url)
-            elif method == "POST":
-                response = await client.post(url, json=data)
-            elif method == "PUT":
-                response = await client.put(url, json=data)
+    async def _read_from(self, target: Endpoint, endpoint: str) -> Dict:
+        """GET a una instancia concreta, respetando su circuit breaker"""
+        breaker = self.endpoint_breakers[target.url]
+        attempt_timeout()  # sin tiempo restante no se elige ni penaliza la instancia
+        if not breaker.can_execute():
+            raise CircuitOpenError(f"Circuit Breaker OPEN para {breaker.name}")
+        
+        started = time.monotonic()
+        try:
+            async with self.balancer.track(target):
+                data = await self._make_request(endpoint, base_url=target.url)
+        except asyncio.CancelledError:
+            # Perdedor de un hedge o llamador desconectado: sin veredicto
+            breaker.release()
+            raise
+        except Exception as e:
+            if is_endpoint_failure(e):
+                breaker.record_failure()
+            elif isinstance(e, httpx.HTTPStatusError):
+                # La instancia respondió (4xx): está sana aunque la petición no
+                breaker.record_success(time.monotonic() - started)
             else:
-                raise ValueError(f"Método HTTP no soportado: {method}")
-            
-            response.raise_for_status()
-            return response.json()
+                # Llamador sin tiempo, sin cupo local u otro error que no es de la instancia
+                breaker.release()
+            raise
+        breaker.record_success(time.monotonic() - started)
+        return data
+    
+    async def _read_any(self, target: Endpoint, endpoint: str) -> Dict:
+        """
+        _read_from en `target`; si su circuit breaker rechaza la petición
+        (abierto o sin cupo de sonda), sigue con las demás instancias. El
+        rechazo no es un veredicto sobre App1: CircuitOpenError solo se
+        propaga si ninguna instancia acepta.
+        """
+        candidates = [target] + [ep for ep in self.balancer.endpoints if ep is not target]
+        for candidate in candidates:
+            try:
+                return await self._read_from(candidate, endpoint)
+            except CircuitOpenError as e:
+                rejected = e
+        raise rejected
+    
+    async def _balanced_get(self, endpoint: str) -> Dict:
+        """
+        GET a la instancia de App1 que elige el balanceador; si tarda más que
+        el percentil de latencia, se cubre con otra instancia (hedging)
+        """
+        target = self.balancer.pick()
+        if not settings.HEDGE_ENABLED or len(self.balancer.endpoints) < 2:
+            return await self._read_any(target, endpoint)
+        return await self.hedger.run(
+            lambda: self._read_any(target, endpoint),
+            lambda: self._read_any(self.balancer.pick(exclude=target), endpoint)
+        )
+    
+    async def _conditional_get(self, client: httpx.AsyncClient, url: str) -> Dict:
+        """
+        GET condicional: envía el ETag guardado en If-None-Match y, ante un
+        304, reutiliza el cuerpo ya recibido sin volver a transferirlo.
+        """
+        async with self.limiter.slot():
+            async with self.bulkhead:
+                timeout = attempt_timeout()
+                headers = deadline_headers(timeout)
+                cached = self._validators.get(url)
+                if cached:
+                    headers["If-None-Match"] = cached[0]
+                response = await client.get(url, headers=headers, timeout=timeout)
+            if not (response.status_code == 304 and cached):
+                response.raise_for_status()
+        
+        if response.status_code == 304 and cached:
+            self._validators.move_to_end(url)
+            return cached[1]
+        
+        body = response.json()
+        
+        etag = response.headers.get("ETag")
+        if etag:
+            self._validators[url] = (etag, body)
+            self._validators.move_to_end(url)
+            while len(self._validators) > settings.APP1_ETAG_CACHE_SIZE:
+                self._validators.popitem(last=False)
+        else:
+            self._validators.pop(url, None)
+        return body
     
     async def create_consulta(self, consulta_data: Dict) -> Dict:
         """
@@ -44,32 +230,68 @@ class App1Client:
         
         try:
             endpoint = "/consultas/"
-            
-            # Mapear campos del middleware al formato de App1
-            app1_data = {
-                "id_paciente": consulta_data.get('patient_id'),
-                "id_medico": consulta_data.get('doctor_id'),
-                "fecha": consulta_data.get('fecha', consulta_data.get('appointment_date')),
-                "motivo": consulta_data.get('notes', consulta_data.get('motivo', '')),
-                "diagnostico": consulta_data.get('diagnosis', consulta_data.get('diagnostico', '')),
-                "tratamiento": consulta_data.get('treatment', consulta_data.get('tratamiento', ''))
-            }
+            app1_data = self._to_app1_consulta(consulta_data)
             
             data = await retry_with_backoff(
                 self._make_request,
                 endpoint,
                 method="POST",
-                data=app1_data
+                data=app1_data,
+                upstream="app1",
+                idempotent=False
             )
             
             self.circuit_breaker.record_success()
             logger.info(f"Consulta creada exitosamente para paciente {consulta_data.get('patient_id')}")
             return data
+        except _NO_VERDICT_ERRORS:
+            # Cancelada, sin tiempo o sin cupo local: sin veredicto (ni réplica)
+            self.circuit_breaker.release()
+            raise
         except Exception as e:
             logger.error(f"Error creando consulta en App1: {e}")
             self.circuit_breaker.record_failure()
             raise
     
+    async def create_consultas_bulk(self, consultas_data: List[Dict]) -> Tuple[int, Dict]:
+        """
+        Crea un lote de consultas médicas en App1 en una sola transacción
+        Endpoint App1: POST /consultas/bulk
+        
+        Retorna (código, cuerpo) tal como los entrega App1: 201 si entraron
+        todas, 207 si solo algunas y 400 si ninguna, con el resultado por fila.
+        Un 4xx es un rechazo del lote, no una falla de App1.
+        """
+        if not self.circuit_breaker.can_execute():
+            logger.warning("Circuit Breaker OPEN para App1 - No se puede crear lote de consultas")
+            raise Exception("Servicio App1 no disponible temporalmente")
+        
+        try:
+            endpoint = "/consultas/bulk"
+            app1_data = [self._to_app1_consulta(consulta) for consulta in consultas_data]
+            
+            status_code, data = await retry_with_backoff(
+                self._make_request,
+                endpoint,
+                method="POST",
+                data=app1_data,
+                upstream="app1",
+                idempotent=False,
+                with_status=True
+            )
+            
+            self.circuit_breaker.record_success()
+            logger.info(f"Lote de consultas procesado ({status_code}): {data.get('inserted')}/{data.get('total')} insertadas")
+            return status_code, data
+        except _NO_VERDICT_ERRORS:
+            # Cancelada, sin tiempo o sin cupo local: sin veredicto (ni réplica)
+            self.circuit_breaker.release()
+            raise
+        except Exception as e:
+            logger.error(f"Error creando lote de consultas en App1: {e}")
+            self.circuit_breaker.record_failure()
+            raise
+    
     async def update_disponibilidad(self, disponibilidad_data: Dict) -> Dict:
         """
         Actualiza la disponibilidad de un médico en App1
@@ -85,37 +307,89 @@ class App1Client:
                 self._make_request,
                 endpoint,
                 method="POST",
-                data=disponibilidad_data
+                data=self._to_app1_disponibilidad(disponibilidad_data),
+                upstream="app1",
+                idempotent=False
             )
             
             self.circuit_breaker.record_success()
             logger.info(f"Disponibilidad actualizada para médico {disponibilidad_data.get('doctor_id')}")
             return data
+        except _NO_VERDICT_ERRORS:
+            # Cancelada, sin tiempo o sin cupo local: sin veredicto (ni réplica)
+            self.circuit_breaker.release()
+            raise
         except Exception as e:
             logger.error(f"Error actualizando disponibilidad en App1: {e}")
             self.circuit_breaker.record_failure()
             raise
     
-    async def get_historial_paciente(self, patient_id: str) -> Optional[Dict]:
+    async def update_disponibilidad_bulk(self, disponibilidades: List[Dict]) -> Dict:
+        """
+        Actualiza la disponibilidad de varios médicos en una sola transacción
+        Endpoint App1: POST /medicos/disponibilidad/bulk
+        """
+        if not self.circuit_breaker.can_execute():
+            logger.warning("Circuit Breaker OPEN para App1 - No se puede actualizar disponibilidad")
+            raise Exception("Servicio App1 no disponible temporalmente")
+        
+        try:
+            endpoint = "/medicos/disponibilidad/bulk"
+            data = await retry_with_backoff(
+                self._make_request,
+                endpoint,
+                method="POST",
+                data=[self._to_app1_disponibilidad(d) for d in disponibilidades],
+                upstream="app1",
+                idempotent=False
+            )
+            
+            self.circuit_breaker.record_success()
+            logger.info(f"Disponibilidad actualizada para {len(data.get('updated', []))} médicos")
+            return data
+        except _NO_VERDICT_ERRORS:
+            # Cancelada, sin tiempo o sin cupo local: sin veredicto (ni réplica)
+            self.circuit_breaker.release()
+            raise
+        except Exception as e:
+            logger.error(f"Error actualizando disponibilidad masiva en App1: {e}")
+            self.circuit_breaker.record_failure()
+            raise
+    
+    async def get_historial_paciente(self, patient_id: str, fallback: bool = True, remember: bool = True) -> Optional[Dict]:
         """
         Obtiene el historial médico de un paciente
         Endpoint App1: GET /consultas/paciente/{id}
+        
+        Con remember=False (lotes) la respuesta no se registra como última
+        buena conocida, para no desplazar las de los pacientes consultados en línea.
         """
         if not self.circuit_breaker.can_execute():
-            logger.warning("Circuit Breaker OPEN para App1 - Retornando datos mock")
-            return self._mock_historial(patient_id)
+            logger.warning("Circuit Breaker OPEN para App1 - Retornando última respuesta conocida")
+            return await self._degrade(fallback, f"app1:historial:{patient_id}", self._unavailable_historial(patient_id), "Circuit Breaker OPEN para App1")
         
         try:
             endpoint = f"/consultas/paciente/{patient_id}"
-            data = await retry_with_backoff(self._make_request, endpoint)
+            data = await retry_with_backoff(self._balanced_get, endpoint, upstream="app1")
             
             # Transformar datos de App1 al formato esperado por App3
             result = self._transform_historial(data, patient_id)
+            if remember:
+                last_known_good.record(f"app1:historial:{patient_id}", result)
             
             self.circuit_breaker.record_success()
             logger.info(f"Historial obtenido exitosamente para paciente {patient_id}")
             return result
             
+        except _NO_VERDICT_ERRORS:
+            # Cancelada, sin tiempo o sin cupo local: sin veredicto (ni réplica)
+            self.circuit_breaker.release()
+            raise
+        except CircuitOpenError as e:
+            # Ninguna instancia aceptó (circuitos abiertos o sin cupo de sonda):
+            # no se llamó a App1, no hay veredicto ni sentido en probar la réplica
+            self.circuit_breaker.release()
+            return await self._degrade(fallback, f"app1:historial:{patient_id}", self._unavailable_historial(patient_id), str(e))
         except Exception as e:
             logger.error(f"Error obteniendo historial de App1: {e}")
             self.circuit_breaker.record_failure()
@@ -124,35 +398,45 @@ class App1Client:
             try:
                 logger.info("Intentando con réplica de App1...")
                 endpoint = f"/consultas/paciente/{patient_id}"
-                data = await self._make_request(endpoint, use_replica=True)
+                data = await self._read_from(self.replica_target, endpoint)
                 result = self._transform_historial(data, patient_id)
+                if remember:
+                    last_known_good.record(f"app1:historial:{patient_id}", result)
                 logger.info("Historial obtenido desde réplica")
                 return result
             except Exception as e2:
                 logger.error(f"Réplica también falló: {e2}")
-                # Fallback a datos mock
-                return self._mock_historial(patient_id)
+                return await self._degrade(fallback, f"app1:historial:{patient_id}", self._unavailable_historial(patient_id), f"App1 no disponible: {e2}")
     
-    async def get_medicos_disponibles(self, specialty: Optional[str] = None) -> List[Dict]:
+    async def get_medicos_disponibles(self, specialty: Optional[str] = None, fallback: bool = True) -> List[Dict]:
         """
         Obtiene la lista de médicos disponibles
         Endpoint App1: GET /medicos/
         """
         if not self.circuit_breaker.can_execute():
-            logger.warning("Circuit Breaker OPEN para App1 - Retornando datos mock")
-            return self._mock_medicos(specialty)
+            logger.warning("Circuit Breaker OPEN para App1 - Retornando última respuesta conocida")
+            return await self._degrade(fallback, self._medicos_key(specialty), [], "Circuit Breaker OPEN para App1")
         
         try:
             endpoint = "/medicos/"
-            data = await retry_with_backoff(self._make_request, endpoint)
+            data = await retry_with_backoff(self._balanced_get, endpoint, upstream="app1")
             
             # Transformar datos
             result = self._transform_medicos(data, specialty)
+            last_known_good.record(self._medicos_key(specialty), result)
             
             self.circuit_breaker.record_success()
             logger.info("Lista de médicos obtenida exitosamente")
             return result
             
+        except _NO_VERDICT_ERRORS:
+            # Cancelada, sin tiempo o sin cupo local: sin veredicto (ni réplica)
+            self.circuit_breaker.release()
+            raise
+        except CircuitOpenError as e:
+            # Ninguna instancia aceptó: sin veredicto sobre App1 (ver get_historial_paciente)
+            self.circuit_breaker.release()
+            return await self._degrade(fallback, self._medicos_key(specialty), [], str(e))
         except Exception as e:
             logger.error(f"Error obteniendo médicos de App1: {e}")
             self.circuit_breaker.record_failure()
@@ -160,13 +444,39 @@ class App1Client:
             # Intentar con réplica
             try:
                 logger.info("Intentando con réplica de App1...")
-                data = await self._make_request(endpoint, use_replica=True)
+                data = await self._read_from(self.replica_target, endpoint)
                 result = self._transform_medicos(data, specialty)
+                last_known_good.record(self._medicos_key(specialty), result)
                 logger.info("Médicos obtenidos desde réplica")
                 return result
             except Exception as e2:
                 logger.error(f"Réplica también falló: {e2}")
-                return self._mock_medicos(specialty)
+                return await self._degrade(fallback, self._medicos_key(specialty), [], f"App1 no disponible: {e2}")
+    
+    def _to_app1_consulta(self, consulta_data: Dict) -> Dict:
+        """Mapea campos del middleware al formato de App1"""
+        return {
+            "id_paciente": consulta_data.get('patient_id'),
+            "id_medico": consulta_data.get('doctor_id'),
+            "fecha": consulta_data.get('fecha', consulta_data.get('appointment_date')),
+            "motivo": consulta_data.get('notes', consulta_data.get('motivo', '')),
+            "diagnostico": consulta_data.get('diagnosis', consulta_data.get('diagnostico', '')),
+            "tratamiento": consulta_data.get('treatment', consulta_data.get('tratamiento', ''))
+        }
+    
+    def _to_app1_disponibilidad(self, disponibilidad_data: Dict) -> Dict:
+        """
+        Mapea una actualización de disponibilidad al formato de App1.
+        App1 guarda solo el flag `disponible`: si no viene explícito, el médico
+        queda disponible cuando tiene al menos un horario libre.
+        """
+        disponible = disponibilidad_data.get('disponible')
+        if disponible is None:
+            disponible = bool(disponibilidad_data.get('available_slots'))
+        return {
+            "id_medico": disponibilidad_data.get('doctor_id', disponibilidad_data.get('id_medico')),
+            "disponible": 1 if disponible else 0
+        }
     
     def _transform_historial(self, data: Dict, patient_id: str) -> Dict:
         """Transforma datos de App1 al formato esperado por App3"""
@@ -225,29 +535,28 @@ class App1Client:
         
         return medicos
     
-    def _mock_historial(self, patient_id: str) -> Dict:
-        """Datos mock cuando App1 no está disponible"""
+    def _medicos_key(self, specialty: Optional[str]) -> str:
+        return f"app1:medicos:{(specialty or '').lower()}"
+    
+    async def _degrade(self, fallback: bool, key: str, default, reason: str):
+        """
+        Respuesta degradada: la última respuesta buena de `key` marcada como
+        stale o, si nunca hubo una, `default`. Con fallback=False se lanza
+        como UpstreamUnavailable.
+        """
+        payload = await last_known_good.get_stale(key)
+        if payload is None:
+            payload = default
+        else:
+            logger.warning(f"Sirviendo última respuesta conocida para {key}")
+        if fallback:
+            return payload
+        raise UpstreamUnavailable(reason, fallback=payload)
+    
+    def _unavailable_historial(self, patient_id: str) -> Dict:
+        """Historial vacío cuando App1 no está disponible y no hay respuesta previa"""
         return {
             'patient_rut': patient_id,
-            'consultations': [
-                {
-                    'id': 999,
-                    'date': '2024-11-15',
-                    'doctor': 'Dr. Mock (Servicio no disponible)',
-                    'specialty': 'Medicina General',
-                    'diagnosis': 'Servicio temporalmente no disponible',
-                    'treatment': 'Por favor intente más tarde'
-                }
-            ]
+            'consultations': [],
+            'unavailable': True
         }
-    
-    def _mock_medicos(self, specialty: Optional[str]) -> List[Dict]:
-        """Datos mock de médicos cuando App1 no está disponible"""
-        return [
-            {
-                'id': 999,
-                'name': 'Dr. Mock (Servicio no disponible)',
-                'specialty': specialty or 'General',
-                'available_slots': []
-            }
-        ]
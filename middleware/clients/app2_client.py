@@ -1,12 +1,27 @@
+import asyncio
 import httpx
 from typing import Dict, Optional
 from config import settings
 from utils.circuit_breaker import get_circuit_breaker
 from utils.retry import retry_with_backoff
+from utils.http_client import create_http_client, http_pool_stats
+from utils.fanout import fan_out
+from utils.singleflight import SingleFlight
+from utils.bulkhead import Bulkhead, BulkheadFull
+from utils.concurrency_limiter import Overloaded, get_limiter
+from utils.cache import LRUCache, MISS
+from utils.errors import CircuitOpenError, DeadlineExceeded, UpstreamUnavailable
+from utils.last_known_good import last_known_good
+from utils.request_context import attempt_timeout, deadline_headers, remaining
 import logging
 
 logger = logging.getLogger(__name__)
 
+# Errores que no dicen nada de la salud del upstream: llamada cancelada,
+# llamador sin tiempo, bulkhead local lleno o limitador de concurrencia.
+# Liberan la sonda del circuit breaker sin registrar éxito ni fallo
+_NO_VERDICT_ERRORS = (asyncio.CancelledError, DeadlineExceeded, BulkheadFull, Overloaded)
+
 class App2Client:
     """Cliente HTTP para comunicarse con App2 (Gestión Administrativa)"""
     
@@ -14,23 +29,85 @@ class App2Client:
         self.base_url = settings.APP2_URL
         self.timeout = settings.REQUEST_TIMEOUT
         self.circuit_breaker = get_circuit_breaker("app2")
+        # Un httpx.AsyncClient compartido por host; se abren en el startup de FastAPI
+        self._http: Dict[str, httpx.AsyncClient] = {}
+        # Compartimento propio: un APP2 lento no agota cupos ni sockets del otro upstream
+        self.bulkhead = Bulkhead(
+            "app2",
+            max_concurrent=settings.APP2_BULKHEAD_MAX_CONCURRENT,
+            max_queue=settings.APP2_BULKHEAD_MAX_QUEUE,
+            queue_timeout=settings.BULKHEAD_QUEUE_TIMEOUT
+        )
+        # Límite adaptativo de llamadas HTTP reales a App2 (no cuenta aciertos de caché)
+        self.limiter = get_limiter("app2")
+        # GETs idénticos concurrentes comparten una sola petición upstream
+        self.singleflight = SingleFlight("app2")
+        # RUT -> datos del paciente (incluye su ID); los 404 se cachean como negativos
+        self.patient_cache = LRUCache(
+            "patients",
+            max_size=settings.PATIENT_CACHE_SIZE,
+            ttl=settings.PATIENT_CACHE_TTL,
+            negative_ttl=settings.PATIENT_CACHE_NEGATIVE_TTL
+        )
+    
+    async def start(self):
+        """Abre los clientes HTTP compartidos (startup de FastAPI)"""
+        for url in (self.base_url,):
+            self._client_for(url)
+        self.patient_cache.load(settings.PATIENT_CACHE_FILE)
+    
+    async def close(self):
+        """Cierra los clientes HTTP compartidos (shutdown de FastAPI)"""
+        for client in self._http.values():
+            await client.aclose()
+        self._http.clear()
+        self.patient_cache.dump(settings.PATIENT_CACHE_FILE)
+    
+    def _client_for(self, base_url: str) -> httpx.AsyncClient:
+        """Cliente HTTP compartido del host; se crea al primer uso si no existe"""
+        client = self._http.get(base_url)
+        if client is None or client.is_closed:
+            client = self._http[base_url] = create_http_client(
+                max_connections=settings.APP2_MAX_CONNECTIONS,
+                metrics_labels=("app2", base_url)
+            )
+        return client
+    
+    def pool_stats(self) -> Dict:
+        """Ocupación de los pools HTTP por host"""
+        return {url: http_pool_stats(client) for url, client in self._http.items()}
     
     async def _make_request(self, endpoint: str, method: str = "GET", data: Optional[Dict] = None) -> Dict:
         """Realiza una petición HTTP con manejo de errores"""
         url = f"{self.base_url}{endpoint}"
+        client = self._client_for(self.base_url)
         
-        async with httpx.AsyncClient(timeout=self.timeout) as client:
-            if method == "GET":
-                response = await client.get(url)
-            elif method == "POST":
-                response = await client.post(url, json=data)
-            elif method == "PUT":
-                response = await client.put(url, json=data)
-            else:
-                raise ValueError(f"Método HTTP no soportado: {method}")
-            
+        if method == "GET":
+            return await self.singleflight.do(url, lambda: self._get(client, url))
+        
+        async with self.limiter.slot():
+            async with self.bulkhead:
+                # Cada intento dura a lo más lo que le queda al llamador
+                timeout = attempt_timeout()
+                headers = deadline_headers(timeout)
+                if method == "POST":
+                    response = await client.post(url, json=data, timeout=timeout, headers=headers)
+                elif method == "PUT":
+                    response = await client.put(url, json=data, timeout=timeout, headers=headers)
+                else:
+                    raise ValueError(f"Método HTTP no soportado: {method}")
+            response.raise_for_status()
+        
+        return response.json()
+    
+    async def _get(self, client: httpx.AsyncClient, url: str) -> Dict:
+        """GET simple; _make_request lo ejecuta a través del single-flight"""
+        async with self.limiter.slot():
+            async with self.bulkhead:
+                timeout = attempt_timeout()
+                response = await client.get(url, timeout=timeout, headers=deadline_headers(timeout))
             response.raise_for_status()
-            return response.json()
+        return response.json()
     
     async def create_patient(self, patient_data: Dict) -> Dict:
         """
@@ -47,12 +124,19 @@ class App2Client:
                 self._make_request,
                 endpoint,
                 method="POST",
-                data=patient_data
+                data=patient_data,
+                upstream="app2",
+                idempotent=False
             )
             
             self.circuit_breaker.record_success()
+            self.patient_cache.invalidate(patient_data.get('rut'))
             logger.info(f"Paciente creado exitosamente: {patient_data.get('rut')}")
             return data
+        except _NO_VERDICT_ERRORS:
+            # Cancelada, sin tiempo o sin cupo local: sin veredicto (ni réplica)
+            self.circuit_breaker.release()
+            raise
         except Exception as e:
             logger.error(f"Error creando paciente en App2: {e}")
             self.circuit_breaker.record_failure()
@@ -73,12 +157,18 @@ class App2Client:
                 self._make_request,
                 endpoint,
                 method="PUT",
-                data=patient_data
+                data=patient_data,
+                upstream="app2"
             )
             
             self.circuit_breaker.record_success()
+            self.patient_cache.invalidate(patient_rut)
             logger.info(f"Paciente actualizado exitosamente: {patient_rut}")
             return data
+        except _NO_VERDICT_ERRORS:
+            # Cancelada, sin tiempo o sin cupo local: sin veredicto (ni réplica)
+            self.circuit_breaker.release()
+            raise
         except Exception as e:
             logger.error(f"Error actualizando paciente en App2: {e}")
             self.circuit_breaker.record_failure()
@@ -99,12 +189,18 @@ class App2Client:
                 self._make_request,
                 endpoint,
                 method="POST",
-                data=payment_data
+                data=payment_data,
+                upstream="app2",
+                idempotent=False
             )
             
             self.circuit_breaker.record_success()
             logger.info(f"Pago registrado exitosamente para paciente: {payment_data.get('patient_rut')}")
             return data
+        except _NO_VERDICT_ERRORS:
+            # Cancelada, sin tiempo o sin cupo local: sin veredicto (ni réplica)
+            self.circuit_breaker.release()
+            raise
         except Exception as e:
             logger.error(f"Error registrando pago en App2: {e}")
             self.circuit_breaker.record_failure()
@@ -125,87 +221,169 @@ class App2Client:
                 self._make_request,
                 endpoint,
                 method="POST",
-                data=voucher_data
+                data=voucher_data,
+                upstream="app2",
+                idempotent=False
             )
             
             self.circuit_breaker.record_success()
             logger.info(f"Comprobante generado exitosamente para paciente: {voucher_data.get('patient_rut')}")
             return data
+        except _NO_VERDICT_ERRORS:
+            # Cancelada, sin tiempo o sin cupo local: sin veredicto (ni réplica)
+            self.circuit_breaker.release()
+            raise
         except Exception as e:
             logger.error(f"Error generando comprobante en App2: {e}")
             self.circuit_breaker.record_failure()
             raise
     
-    async def get_payment_info(self, patient_rut: str) -> Optional[Dict]:
+    async def get_payment_info(self, patient_rut: str, fallback: bool = True, remember: bool = True) -> Optional[Dict]:
         """
         Obtiene información de pagos y facturas del paciente
         Endpoint App2: GET /payments/{patient_id}
+        
+        Con remember=False (lotes) la respuesta no se registra como última
+        buena conocida, para no desplazar las de los pacientes consultados en línea.
         """
         if not self.circuit_breaker.can_execute():
-            logger.warning("Circuit Breaker OPEN para App2 - Retornando datos mock")
-            return self._mock_payment_info(patient_rut)
+            logger.warning("Circuit Breaker OPEN para App2 - Retornando última respuesta conocida")
+            return await self._degrade(fallback, f"app2:pagos:{patient_rut}", self._unavailable_payment_info(patient_rut), "Circuit Breaker OPEN para App2")
         
         try:
-            # Primero obtener el paciente para conseguir su ID
-            patient = await self.get_patient_data(patient_rut)
+            # Primero obtener el paciente para conseguir su ID. Un 404 de App2 es
+            # una respuesta definitiva (None -> 404), no una caída a degradar.
+            # La llamada ya reservó el breaker: la búsqueda no reserva otra sonda
+            # y el resultado se registra una sola vez, aquí
+            patient = await self._lookup_patient(patient_rut, reserve=False)
             if not patient:
-                logger.warning(f"Paciente no encontrado: {patient_rut}, usando mock")
-                return self._mock_payment_info(patient_rut)
+                logger.warning(f"Paciente no encontrado: {patient_rut}")
+                self.circuit_breaker.record_success()
+                return None
             
             patient_id = patient.get('id')
             if not patient_id:
                 logger.error(f"ID de paciente no encontrado para {patient_rut}")
-                return self._mock_payment_info(patient_rut)
+                self.circuit_breaker.release()
+                return await self._degrade(fallback, f"app2:pagos:{patient_rut}", self._unavailable_payment_info(patient_rut), f"ID de paciente no encontrado para {patient_rut}")
             
-            # Intentar obtener pagos
-            payments_endpoint = f"/payments/{patient_id}"
-            try:
-                payments_data = await retry_with_backoff(self._make_request, payments_endpoint)
-            except:
-                # Si no hay pagos, retornar lista vacía
-                payments_data = []
+            # Sin presupuesto no tiene sentido abrir el fan-out (0 no es "sin deadline")
+            left = remaining()
+            if left is not None and left <= 0:
+                self.circuit_breaker.release()
+                return await self._degrade(fallback, f"app2:pagos:{patient_rut}", self._unavailable_payment_info(patient_rut), "Deadline de la petición agotado")
             
-            # Intentar obtener facturas (invoices)
-            try:
-                invoices_endpoint = f"/invoices/{patient_id}"
-                invoices_data = await self._make_request(invoices_endpoint)
-            except:
-                invoices_data = []
+            # Pagos y facturas son independientes: se piden en paralelo (ambas
+            # con reintentos, son GETs idempotentes) bajo un mismo deadline. Si
+            # una rama falla se responde con lo que haya.
+            branches = {
+                "payments": lambda: retry_with_backoff(self._make_request, f"/payments/{patient_id}", upstream="app2"),
+                "invoices": lambda: retry_with_backoff(self._make_request, f"/invoices/{patient_id}", upstream="app2")
+            }
+            caller_bound = left is not None and left < settings.FANOUT_DEADLINE
+            results, errors = await fan_out(
+                branches,
+                deadline=min(settings.FANOUT_DEADLINE, left) if caller_bound else settings.FANOUT_DEADLINE,
+                defaults={"payments": [], "invoices": []}
+            )
+            if len(errors) == len(branches):
+                # Sin ninguna rama no hay respuesta parcial sino una caída: se
+                # degrada a la última respuesta buena. Si el deadline lo puso el
+                # llamador, quedarse sin tiempo no es culpa de App2
+                logger.error(f"Todas las ramas de pagos fallaron para {patient_rut}: {errors}")
+                if caller_bound:
+                    self.circuit_breaker.release()
+                else:
+                    self.circuit_breaker.record_failure()
+                return await self._degrade(fallback, f"app2:pagos:{patient_rut}", self._unavailable_payment_info(patient_rut), f"App2 no disponible: {errors}")
+            payments_data = results["payments"]
+            invoices_data = results["invoices"]
             
             # Transformar datos al formato esperado por App3
             result = self._transform_payment_info(payments_data, invoices_data, patient_rut)
+            result['partial'] = bool(errors)
+            if errors:
+                result['errors'] = errors
+            elif remember:
+                last_known_good.record(f"app2:pagos:{patient_rut}", result)
             
             self.circuit_breaker.record_success()
             logger.info(f"Información de pagos obtenida para paciente {patient_rut} (ID: {patient_id})")
             return result
             
+        except UpstreamUnavailable:
+            raise
+        except _NO_VERDICT_ERRORS:
+            # Cancelada, sin tiempo o sin cupo local: sin veredicto (ni réplica)
+            self.circuit_breaker.release()
+            raise
         except Exception as e:
             logger.error(f"Error obteniendo información de App2: {e}")
             self.circuit_breaker.record_failure()
-            # Fallback a datos mock
-            return self._mock_payment_info(patient_rut)
+            return await self._degrade(fallback, f"app2:pagos:{patient_rut}", self._unavailable_payment_info(patient_rut), f"App2 no disponible: {e}")
     
     async def get_patient_data(self, patient_rut: str) -> Optional[Dict]:
         """
         Obtiene datos personales del paciente
         Endpoint App2: GET /patients?rut={rut}
+        
+        Retorna None tanto si el paciente no existe como si App2 falla; solo
+        el descarte por el limitador de concurrencia se propaga (503).
         """
-        if not self.circuit_breaker.can_execute():
-            logger.warning("Circuit Breaker OPEN para App2")
+        try:
+            return await self._lookup_patient(patient_rut)
+        except Overloaded:
+            raise
+        except Exception as e:
+            logger.error(f"Error obteniendo datos de paciente de App2: {e}")
             return None
+    
+    async def _lookup_patient(self, patient_rut: str, reserve: bool = True) -> Optional[Dict]:
+        """
+        Busca el paciente por RUT. Retorna None solo si App2 confirma que no
+        existe (404); las fallas de App2 se lanzan.
+        
+        Usa la caché RUT -> paciente (compartida con get_payment_info); los
+        RUT inexistentes quedan en caché negativa por PATIENT_CACHE_NEGATIVE_TTL.
+        
+        Con reserve=False no consulta ni actualiza el circuit breaker: el
+        llamador ya reservó la llamada y registra el resultado.
+        """
+        cached = self.patient_cache.get(patient_rut)
+        if cached is not MISS:
+            return cached
+        
+        if reserve and not self.circuit_breaker.can_execute():
+            logger.warning("Circuit Breaker OPEN para App2")
+            raise CircuitOpenError("Circuit Breaker OPEN para App2")
         
         try:
             # Usar query parameter para buscar directamente por RUT
             endpoint = f"/patients?rut={patient_rut}"
-            data = await retry_with_backoff(self._make_request, endpoint)
-            
+            data = await retry_with_backoff(self._make_request, endpoint, upstream="app2")
+        except httpx.HTTPStatusError as e:
+            if e.response.status_code == 404:
+                # App2 respondió bien: el paciente no existe
+                if reserve:
+                    self.circuit_breaker.record_success()
+                self.patient_cache.set_negative(patient_rut)
+                return None
+            if reserve:
+                self.circuit_breaker.record_failure()
+            raise
+        except _NO_VERDICT_ERRORS:
+            if reserve:
+                self.circuit_breaker.release()
+            raise
+        except Exception:
+            if reserve:
+                self.circuit_breaker.record_failure()
+            raise
+        
+        if reserve:
             self.circuit_breaker.record_success()
-            return data
-            
-        except Exception as e:
-            logger.error(f"Error obteniendo datos de paciente de App2: {e}")
-            self.circuit_breaker.record_failure()
-            return None
+        self.patient_cache.set(patient_rut, data)
+        return data
     
     def _transform_payment_info(self, payments_data: any, invoices_data: any, patient_rut: str) -> Dict:
         """Transforma datos de App2 al formato esperado por App3"""
@@ -256,19 +434,28 @@ class App2Client:
             'total_debt': total_debt
         }
     
-    def _mock_payment_info(self, patient_rut: str) -> Dict:
-        """Datos mock cuando App2 no está disponible"""
+    async def _degrade(self, fallback: bool, key: str, default, reason: str):
+        """
+        Respuesta degradada: la última respuesta buena de `key` marcada como
+        stale o, si nunca hubo una, `default`. Con fallback=False se lanza
+        como UpstreamUnavailable.
+        """
+        payload = await last_known_good.get_stale(key)
+        if payload is None:
+            payload = default
+        else:
+            logger.warning(f"Sirviendo última respuesta conocida para {key}")
+        if fallback:
+            return payload
+        raise UpstreamUnavailable(reason, fallback=payload)
+    
+    def _unavailable_payment_info(self, patient_rut: str) -> Dict:
+        """Información de pagos vacía cuando App2 no está disponible y no hay respuesta previa"""
         return {
             'patient_rut': patient_rut,
             'payments': [],
-            'pending_invoices': [
-                {
-                    'id': 999,
-                    'date': '2024-12-01',
-                    'amount': 0,
-                    'description': 'Servicio temporalmente no disponible',
-                    'due_date': '2024-12-31'
-                }
-            ],
-            'total_debt': 0
+            'pending_invoices': [],
+            'paid_invoices': [],
+            'total_debt': 0,
+            'unavailable': True
         }
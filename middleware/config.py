@@ -5,16 +5,99 @@ class Settings(BaseSettings):
     # URLs de las aplicaciones
     APP1_URL: str = os.getenv("APP1_URL", "http://localhost:5001")
     APP1_REPLICA_URL: str = os.getenv("APP1_REPLICA_URL", "http://localhost:5002")
+    APP1_EXTRA_URLS: str = os.getenv("APP1_EXTRA_URLS", "")  # instancias adicionales de App1, separadas por coma
     APP2_URL: str = os.getenv("APP2_URL", "http://localhost:3002")
     
     # Configuración de timeouts y reintentos
     REQUEST_TIMEOUT: int = int(os.getenv("REQUEST_TIMEOUT", "5"))
     MAX_RETRIES: int = int(os.getenv("MAX_RETRIES", "3"))
     RETRY_DELAY: float = 1.0  # segundos
+    RETRY_MAX_DELAY: float = float(os.getenv("RETRY_MAX_DELAY", "4"))  # tope de la espera entre intentos
+    RETRY_DEADLINE: float = float(os.getenv("RETRY_DEADLINE", "10"))  # segundos totales para una llamada con reintentos
+    RETRY_BUDGET_RATIO: float = float(os.getenv("RETRY_BUDGET_RATIO", "0.2"))  # reintentos por llamada, como máximo
+    RETRY_BUDGET_BURST: float = float(os.getenv("RETRY_BUDGET_BURST", "10"))  # reintentos acumulables por upstream
+    DEADLINE_MARGIN: float = float(os.getenv("DEADLINE_MARGIN", "0.05"))  # segundos reservados del deadline de App3 para responder
+    FANOUT_DEADLINE: float = float(os.getenv("FANOUT_DEADLINE", "10"))  # segundos para todas las ramas de un fan-out
     
-    # Circuit Breaker
-    CIRCUIT_BREAKER_THRESHOLD: int = 5  # fallos consecutivos para abrir circuito
+    # Circuit Breaker (ventana deslizante de tasa de fallos y de llamadas lentas)
     CIRCUIT_BREAKER_TIMEOUT: int = 30  # segundos antes de intentar cerrar
+    CIRCUIT_BREAKER_WINDOW: float = float(os.getenv("CIRCUIT_BREAKER_WINDOW", "30"))  # segundos observados
+    CIRCUIT_BREAKER_BUCKETS: int = int(os.getenv("CIRCUIT_BREAKER_BUCKETS", "10"))  # tramos de la ventana
+    CIRCUIT_BREAKER_MIN_CALLS: int = int(os.getenv("CIRCUIT_BREAKER_MIN_CALLS", "5"))  # llamadas mínimas para evaluar
+    CIRCUIT_BREAKER_FAILURE_RATE: float = float(os.getenv("CIRCUIT_BREAKER_FAILURE_RATE", "0.5"))
+    CIRCUIT_BREAKER_SLOW_CALL_RATE: float = float(os.getenv("CIRCUIT_BREAKER_SLOW_CALL_RATE", "0.8"))
+    CIRCUIT_BREAKER_SLOW_CALL_DURATION: float = float(os.getenv("CIRCUIT_BREAKER_SLOW_CALL_DURATION", "3"))  # segundos
+    CIRCUIT_BREAKER_HALF_OPEN_PROBES: int = int(os.getenv("CIRCUIT_BREAKER_HALF_OPEN_PROBES", "2"))  # sondas simultáneas
+    CIRCUIT_BREAKER_PROBE_TIMEOUT: float = float(os.getenv("CIRCUIT_BREAKER_PROBE_TIMEOUT", "15"))  # segundos
+    
+    # Pool de conexiones HTTP hacia App1/App2 (un cliente compartido por host)
+    HTTP_MAX_CONNECTIONS_PER_HOST: int = int(os.getenv("HTTP_MAX_CONNECTIONS_PER_HOST", "100"))
+    HTTP_MAX_KEEPALIVE_CONNECTIONS: int = int(os.getenv("HTTP_MAX_KEEPALIVE_CONNECTIONS", "20"))
+    HTTP_KEEPALIVE_EXPIRY: float = float(os.getenv("HTTP_KEEPALIVE_EXPIRY", "30"))  # segundos
+    HTTP2_ENABLED: bool = os.getenv("HTTP2_ENABLED", "false").lower() == "true"
+    
+    # Bulkheads: compartimentos separados de llamadas y conexiones por upstream
+    APP1_BULKHEAD_MAX_CONCURRENT: int = int(os.getenv("APP1_BULKHEAD_MAX_CONCURRENT", "60"))  # llamadas simultáneas a App1
+    APP1_BULKHEAD_MAX_QUEUE: int = int(os.getenv("APP1_BULKHEAD_MAX_QUEUE", "100"))  # llamadas esperando turno
+    APP1_MAX_CONNECTIONS: int = int(os.getenv("APP1_MAX_CONNECTIONS", "60"))  # por instancia de App1
+    APP2_BULKHEAD_MAX_CONCURRENT: int = int(os.getenv("APP2_BULKHEAD_MAX_CONCURRENT", "40"))
+    APP2_BULKHEAD_MAX_QUEUE: int = int(os.getenv("APP2_BULKHEAD_MAX_QUEUE", "60"))
+    APP2_MAX_CONNECTIONS: int = int(os.getenv("APP2_MAX_CONNECTIONS", "40"))
+    BULKHEAD_QUEUE_TIMEOUT: float = float(os.getenv("BULKHEAD_QUEUE_TIMEOUT", "1"))  # segundos esperando turno
+    
+    # Límite de concurrencia adaptativo (AIMD) por upstream
+    LIMITER_ENABLED: bool = os.getenv("LIMITER_ENABLED", "true").lower() == "true"
+    LIMITER_INITIAL: int = int(os.getenv("LIMITER_INITIAL", "20"))  # peticiones simultáneas al arrancar
+    LIMITER_MIN: int = int(os.getenv("LIMITER_MIN", "2"))
+    LIMITER_MAX: int = int(os.getenv("LIMITER_MAX", "200"))
+    LIMITER_BACKOFF: float = float(os.getenv("LIMITER_BACKOFF", "0.9"))  # factor ante latencia alta o error
+    LIMITER_TOLERANCE: float = float(os.getenv("LIMITER_TOLERANCE", "2"))  # veces la latencia mínima tolerada
+    LIMITER_LATENCY_FLOOR: float = float(os.getenv("LIMITER_LATENCY_FLOOR", "0.1"))  # segundos bajo los que no se reduce
+    LIMITER_MIN_RTT_WINDOW: float = float(os.getenv("LIMITER_MIN_RTT_WINDOW", "30"))  # segundos antes de re-aprender la latencia base
+    LIMITER_QUEUE_SIZE: int = int(os.getenv("LIMITER_QUEUE_SIZE", "50"))  # peticiones en espera por upstream
+    LIMITER_QUEUE_TIMEOUT: float = float(os.getenv("LIMITER_QUEUE_TIMEOUT", "0.5"))  # segundos en cola antes de descartar
+    
+    # Caché RUT -> paciente de App2
+    PATIENT_CACHE_SIZE: int = int(os.getenv("PATIENT_CACHE_SIZE", "10000"))
+    PATIENT_CACHE_TTL: float = float(os.getenv("PATIENT_CACHE_TTL", "600"))  # segundos
+    PATIENT_CACHE_NEGATIVE_TTL: float = float(os.getenv("PATIENT_CACHE_NEGATIVE_TTL", "30"))  # segundos para 404
+    PATIENT_CACHE_FILE: str = os.getenv("PATIENT_CACHE_FILE", "")  # vacío = sin persistencia
+    
+    # Caché de respuestas de rutas de lectura (stale-while-revalidate)
+    RESPONSE_CACHE_SIZE: int = int(os.getenv("RESPONSE_CACHE_SIZE", "5000"))
+    CACHE_TTL_DOCTORS: float = float(os.getenv("CACHE_TTL_DOCTORS", "30"))  # segundos frescos
+    CACHE_TTL_MEDICAL_HISTORY: float = float(os.getenv("CACHE_TTL_MEDICAL_HISTORY", "15"))
+    CACHE_TTL_PAYMENTS: float = float(os.getenv("CACHE_TTL_PAYMENTS", "15"))
+    CACHE_STALE_TTL: float = float(os.getenv("CACHE_STALE_TTL", "300"))  # segundos extra sirviendo stale mientras se revalida
+    
+    # Última respuesta buena por clave, servida como stale durante caídas
+    LKG_MAX_ENTRIES: int = int(os.getenv("LKG_MAX_ENTRIES", "5000"))  # en memoria
+    LKG_SPILL_PATH: str = os.getenv("LKG_SPILL_PATH", "")  # archivo SQLite; vacío = solo memoria
+    LKG_SPILL_MAX_ENTRIES: int = int(os.getenv("LKG_SPILL_MAX_ENTRIES", "100000"))
+    LKG_SPILL_BATCH: int = int(os.getenv("LKG_SPILL_BATCH", "100"))  # entradas desalojadas por escritura a SQLite
+    
+    # Balanceo de lecturas entre instancias de App1
+    LB_STRATEGY: str = os.getenv("LB_STRATEGY", "p2c")  # "p2c" o "least_outstanding"
+    LB_EWMA_ALPHA: float = float(os.getenv("LB_EWMA_ALPHA", "0.3"))  # peso de la última latencia
+    LB_ERROR_PENALTY: float = float(os.getenv("LB_ERROR_PENALTY", "5"))  # segundos imputados a un error
+    LB_PROBE_INTERVAL: float = float(os.getenv("LB_PROBE_INTERVAL", "10"))  # segundos sin muestras antes de volver a probar
+    
+    # Lecturas con cobertura (hedging) primary -> réplica de App1
+    HEDGE_ENABLED: bool = os.getenv("HEDGE_ENABLED", "true").lower() == "true"
+    HEDGE_PERCENTILE: float = float(os.getenv("HEDGE_PERCENTILE", "95"))  # percentil de latencia del primary
+    HEDGE_INITIAL_DELAY: float = float(os.getenv("HEDGE_INITIAL_DELAY", "0.5"))  # segundos, hasta tener muestras
+    HEDGE_MIN_DELAY: float = float(os.getenv("HEDGE_MIN_DELAY", "0.02"))  # segundos
+    HEDGE_MIN_SAMPLES: int = int(os.getenv("HEDGE_MIN_SAMPLES", "20"))
+    HEDGE_LATENCY_WINDOW: int = int(os.getenv("HEDGE_LATENCY_WINDOW", "200"))  # latencias recientes consideradas
+    HEDGE_BUDGET_RATIO: float = float(os.getenv("HEDGE_BUDGET_RATIO", "0.1"))  # fracción máxima de lecturas con cobertura
+    HEDGE_BUDGET_BURST: float = float(os.getenv("HEDGE_BUDGET_BURST", "10"))  # coberturas acumulables
+    
+    # Validadores ETag de App1 (GET condicionales)
+    APP1_ETAG_CACHE_SIZE: int = int(os.getenv("APP1_ETAG_CACHE_SIZE", "256"))  # URLs recordadas
+    
+    # Endpoints en lote (varios RUT por petición, respuesta NDJSON)
+    BATCH_MAX_ITEMS: int = int(os.getenv("BATCH_MAX_ITEMS", "1000"))  # RUT distintos por lote
+    BATCH_CONCURRENCY: int = int(os.getenv("BATCH_CONCURRENCY", "10"))  # consultas simultáneas por lote
     
     class Config:
         env_file = ".env"
@@ -1,7 +1,12 @@
 from fastapi import APIRouter, HTTPException
+from fastapi.responses import StreamingResponse
 from clients.app2_client import App2Client
+from config import settings
+from utils.response_cache import response_cache
+from utils.concurrency_limiter import Overloaded
+from utils.batch import NDJSON_MEDIA_TYPE, stream_batch, unique_keys, validate_batch
 from pydantic import BaseModel
-from typing import Optional
+from typing import List, Optional
 import logging
 
 logger = logging.getLogger(__name__)
@@ -37,6 +42,32 @@ class VoucherCreate(BaseModel):
     amount: float
     payment_method: str
 
+class BatchRuts(BaseModel):
+    patient_ruts: List[str]
+
+async def _load_payments(patient_rut: str, cached: bool = True):
+    """
+    Pagos y facturas de un paciente vía caché de respuestas; 404 si App2 no
+    tiene datos. Los lotes (cached=False) van directo a App2 (ver _load_history
+    en medical_routes).
+    """
+    if cached:
+        payment_info = await response_cache.get_or_load(
+            f"payments:{patient_rut}",
+            lambda: app2_client.get_payment_info(patient_rut, fallback=False),
+            ttl=settings.CACHE_TTL_PAYMENTS,
+            stale_ttl=settings.CACHE_STALE_TTL,
+            should_cache=lambda info: bool(info) and not info.get('partial')
+        )
+    else:
+        payment_info = await app2_client.get_payment_info(patient_rut, fallback=False, remember=False)
+    if not payment_info:
+        raise HTTPException(
+            status_code=404,
+            detail=f"No se encontró información de pagos para el paciente {patient_rut}"
+        )
+    return payment_info
+
 @router.get("/payments/{patient_rut}")
 async def get_payments(patient_rut: str):
     """
@@ -44,16 +75,8 @@ async def get_payments(patient_rut: str):
     """
     try:
         logger.info(f"Solicitud de información de pagos para paciente: {patient_rut}")
-        payment_info = await app2_client.get_payment_info(patient_rut)
-        
-        if payment_info:
-            return payment_info
-        else:
-            raise HTTPException(
-                status_code=404,
-                detail=f"No se encontró información de pagos para el paciente {patient_rut}"
-            )
-    except HTTPException:
+        return await _load_payments(patient_rut)
+    except (HTTPException, Overloaded):
         raise
     except Exception as e:
         logger.error(f"Error en get_payments: {e}")
@@ -62,6 +85,23 @@ async def get_payments(patient_rut: str):
             detail=f"Error obteniendo información de pagos: {str(e)}"
         )
 
+@router.post("/payments/batch")
+async def get_payments_batch(batch: BatchRuts):
+    """
+    Obtiene pagos y facturas de varios pacientes desde App2.
+    Los RUT repetidos se consultan una vez, sin pasar por la caché de
+    respuestas; responde NDJSON con una línea
+    por paciente ({"patient_rut", "data"} o {"patient_rut", "error", "status"})
+    a medida que cada consulta termina.
+    """
+    ruts = unique_keys(batch.patient_ruts)
+    validate_batch(ruts)
+    logger.info(f"Solicitud de pagos en lote para {len(ruts)} pacientes")
+    return StreamingResponse(
+        stream_batch(ruts, lambda rut: _load_payments(rut, cached=False), "patient_rut"),
+        media_type=NDJSON_MEDIA_TYPE
+    )
+
 @router.get("/patient/{patient_rut}")
 async def get_patient(patient_rut: str):
     """
@@ -78,7 +118,7 @@ async def get_patient(patient_rut: str):
                 status_code=404,
                 detail=f"No se encontró el paciente {patient_rut}"
             )
-    except HTTPException:
+    except (HTTPException, Overloaded):
         raise
     except Exception as e:
         logger.error(f"Error en get_patient: {e}")
@@ -95,7 +135,10 @@ async def create_patient(patient: PatientCreate):
     try:
         logger.info(f"Creando paciente: {patient.rut}")
         result = await app2_client.create_patient(patient.dict())
+        response_cache.invalidate(f"payments:{patient.rut}")
         return result
+    except Overloaded:
+        raise
     except Exception as e:
         logger.error(f"Error en create_patient: {e}")
         raise HTTPException(
@@ -112,6 +155,8 @@ async def update_patient(patient_rut: str, patient: PatientUpdate):
         logger.info(f"Actualizando paciente: {patient_rut}")
         result = await app2_client.update_patient(patient_rut, patient.dict(exclude_unset=True))
         return result
+    except Overloaded:
+        raise
     except Exception as e:
         logger.error(f"Error en update_patient: {e}")
         raise HTTPException(
@@ -127,7 +172,10 @@ async def create_payment(payment: PaymentCreate):
     try:
         logger.info(f"Registrando pago para paciente: {payment.patient_rut}")
         result = await app2_client.create_payment(payment.dict())
+        response_cache.invalidate(f"payments:{payment.patient_rut}")
         return result
+    except Overloaded:
+        raise
     except Exception as e:
         logger.error(f"Error en create_payment: {e}")
         raise HTTPException(
@@ -143,7 +191,10 @@ async def generate_voucher(voucher: VoucherCreate):
     try:
         logger.info(f"Generando comprobante para paciente: {voucher.patient_rut}")
         result = await app2_client.generate_voucher(voucher.dict())
+        response_cache.invalidate(f"payments:{voucher.patient_rut}")
         return result
+    except Overloaded:
+        raise
     except Exception as e:
         logger.error(f"Error en generate_voucher: {e}")
         raise HTTPException(
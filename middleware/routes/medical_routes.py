@@ -1,6 +1,11 @@
 from fastapi import APIRouter, HTTPException
+from fastapi.responses import JSONResponse, StreamingResponse
 from clients.app1_client import App1Client
-from typing import Optional
+from config import settings
+from utils.response_cache import response_cache
+from utils.concurrency_limiter import Overloaded
+from utils.batch import NDJSON_MEDIA_TYPE, stream_batch, unique_keys, validate_batch
+from typing import List, Optional
 from pydantic import BaseModel
 import logging
 
@@ -20,10 +25,51 @@ class ConsultaCreate(BaseModel):
     treatment: str
     notes: Optional[str] = None
     fecha: Optional[str] = None
+    patient_rut: Optional[str] = None  # permite invalidar solo el historial cacheado de ese RUT
 
 class DisponibilidadUpdate(BaseModel):
     doctor_id: int
     available_slots: list[str]
+    disponible: Optional[bool] = None
+
+class BatchRuts(BaseModel):
+    patient_ruts: List[str]
+
+def _invalidate_history(consulta: ConsultaCreate):
+    """
+    Invalida el historial cacheado del paciente de una consulta nueva.
+    El historial se cachea por el identificador de la URL (normalmente el RUT);
+    si la consulta no trae patient_rut no se puede saber qué clave usó App3,
+    así que se invalida todo el historial.
+    """
+    response_cache.invalidate(f"history:{consulta.patient_id}")
+    if consulta.patient_rut:
+        response_cache.invalidate(f"history:{consulta.patient_rut}")
+    else:
+        response_cache.invalidate_prefix("history:")
+
+async def _load_history(patient_rut: str, cached: bool = True):
+    """
+    Historial de un paciente vía caché de respuestas; 404 si App1 no tiene datos.
+    Los lotes (cached=False) van directo a App1: miles de RUT leídos una vez
+    desplazarían de la caché y del almacén de última respuesta buena a los
+    pacientes consultados en línea.
+    """
+    if cached:
+        history = await response_cache.get_or_load(
+            f"history:{patient_rut}",
+            lambda: app1_client.get_historial_paciente(patient_rut, fallback=False),
+            ttl=settings.CACHE_TTL_MEDICAL_HISTORY,
+            stale_ttl=settings.CACHE_STALE_TTL
+        )
+    else:
+        history = await app1_client.get_historial_paciente(patient_rut, fallback=False, remember=False)
+    if not history:
+        raise HTTPException(
+            status_code=404,
+            detail=f"No se encontró historial para el paciente {patient_rut}"
+        )
+    return history
 
 @router.get("/medical-history/{patient_rut}")
 async def get_medical_history(patient_rut: str):
@@ -32,16 +78,8 @@ async def get_medical_history(patient_rut: str):
     """
     try:
         logger.info(f"Solicitud de historial médico para paciente: {patient_rut}")
-        history = await app1_client.get_historial_paciente(patient_rut)
-        
-        if history:
-            return history
-        else:
-            raise HTTPException(
-                status_code=404,
-                detail=f"No se encontró historial para el paciente {patient_rut}"
-            )
-    except HTTPException:
+        return await _load_history(patient_rut)
+    except (HTTPException, Overloaded):
         raise
     except Exception as e:
         logger.error(f"Error en get_medical_history: {e}")
@@ -50,6 +88,23 @@ async def get_medical_history(patient_rut: str):
             detail=f"Error obteniendo historial médico: {str(e)}"
         )
 
+@router.post("/medical-history/batch")
+async def get_medical_history_batch(batch: BatchRuts):
+    """
+    Obtiene el historial médico de varios pacientes desde App1.
+    Los RUT repetidos se consultan una vez, sin pasar por la caché de
+    respuestas; responde NDJSON con una línea
+    por paciente ({"patient_rut", "data"} o {"patient_rut", "error", "status"})
+    a medida que cada consulta termina.
+    """
+    ruts = unique_keys(batch.patient_ruts)
+    validate_batch(ruts)
+    logger.info(f"Solicitud de historial médico en lote para {len(ruts)} pacientes")
+    return StreamingResponse(
+        stream_batch(ruts, lambda rut: _load_history(rut, cached=False), "patient_rut"),
+        media_type=NDJSON_MEDIA_TYPE
+    )
+
 @router.get("/doctors")
 async def get_doctors(specialty: Optional[str] = None):
     """
@@ -59,8 +114,15 @@ async def get_doctors(specialty: Optional[str] = None):
     """
     try:
         logger.info(f"Solicitud de médicos disponibles (especialidad: {specialty})")
-        doctors = await app1_client.get_medicos_disponibles(specialty)
+        doctors = await response_cache.get_or_load(
+            f"doctors:{(specialty or '').lower()}",
+            lambda: app1_client.get_medicos_disponibles(specialty, fallback=False),
+            ttl=settings.CACHE_TTL_DOCTORS,
+            stale_ttl=settings.CACHE_STALE_TTL
+        )
         return doctors
+    except Overloaded:
+        raise
     except Exception as e:
         logger.error(f"Error en get_doctors: {e}")
         raise HTTPException(
@@ -76,7 +138,10 @@ async def create_consultation(consulta: ConsultaCreate):
     try:
         logger.info(f"Creando consulta para paciente: {consulta.patient_id}")
         result = await app1_client.create_consulta(consulta.dict())
+        _invalidate_history(consulta)
         return result
+    except Overloaded:
+        raise
     except Exception as e:
         logger.error(f"Error en create_consultation: {e}")
         raise HTTPException(
@@ -84,6 +149,32 @@ async def create_consultation(consulta: ConsultaCreate):
             detail=f"Error creando consulta: {str(e)}"
         )
 
+@router.post("/consultations/bulk")
+async def create_consultations_bulk(consultas: List[ConsultaCreate]):
+    """
+    Crea un lote de consultas médicas en App1 (una sola transacción).
+    Retorna el resultado por fila con el código de App1 (201, 207 o 400).
+    """
+    try:
+        logger.info(f"Creando lote de {len(consultas)} consultas")
+        status_code, result = await app1_client.create_consultas_bulk([c.dict() for c in consultas])
+        created = {
+            row.get("index") for row in result.get("results", [])
+            if isinstance(row, dict) and row.get("status") == "created"
+        }
+        for index, consulta in enumerate(consultas):
+            if index in created:
+                _invalidate_history(consulta)
+        return JSONResponse(status_code=status_code, content=result)
+    except Overloaded:
+        raise
+    except Exception as e:
+        logger.error(f"Error en create_consultations_bulk: {e}")
+        raise HTTPException(
+            status_code=500,
+            detail=f"Error creando lote de consultas: {str(e)}"
+        )
+
 @router.post("/doctors/availability")
 async def update_doctor_availability(disponibilidad: DisponibilidadUpdate):
     """
@@ -92,10 +183,32 @@ async def update_doctor_availability(disponibilidad: DisponibilidadUpdate):
     try:
         logger.info(f"Actualizando disponibilidad del médico: {disponibilidad.doctor_id}")
         result = await app1_client.update_disponibilidad(disponibilidad.dict())
+        response_cache.invalidate_prefix("doctors:")
         return result
+    except Overloaded:
+        raise
     except Exception as e:
         logger.error(f"Error en update_doctor_availability: {e}")
         raise HTTPException(
             status_code=500,
             detail=f"Error actualizando disponibilidad: {str(e)}"
         )
+
+@router.post("/doctors/availability/bulk")
+async def update_doctors_availability_bulk(disponibilidades: List[DisponibilidadUpdate]):
+    """
+    Actualiza la disponibilidad de varios médicos en App1 (una sola transacción)
+    """
+    try:
+        logger.info(f"Actualizando disponibilidad de {len(disponibilidades)} médicos")
+        result = await app1_client.update_disponibilidad_bulk([d.dict() for d in disponibilidades])
+        response_cache.invalidate_prefix("doctors:")
+        return result
+    except Overloaded:
+        raise
+    except Exception as e:
+        logger.error(f"Error en update_doctors_availability_bulk: {e}")
+        raise HTTPException(
+            status_code=500,
+            detail=f"Error actualizando disponibilidad: {str(e)}"
+        )
@@ -0,0 +1,83 @@
+import json
+import asyncio
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, Iterable, List
+from fastapi import HTTPException
+from config import settings
+from utils.concurrency_limiter import Overloaded
+from utils.errors import UpstreamUnavailable
+import logging
+
+logger = logging.getLogger(__name__)
+
+NDJSON_MEDIA_TYPE = "application/x-ndjson"
+
+def unique_keys(keys: Iterable[str]) -> List[str]:
+    """Quita espacios, vacíos y duplicados conservando el orden de llegada"""
+    seen = set()
+    result = []
+    for key in keys:
+        key = key.strip()
+        if key and key not in seen:
+            seen.add(key)
+            result.append(key)
+    return result
+
+def validate_batch(keys: List[str]):
+    if len(keys) > settings.BATCH_MAX_ITEMS:
+        raise HTTPException(
+            status_code=413,
+            detail=f"El lote tiene {len(keys)} elementos (máximo {settings.BATCH_MAX_ITEMS})"
+        )
+
+async def _load_item(key_field: str, key: str, load: Callable[[str], Awaitable[Any]]) -> Dict[str, Any]:
+    """Resultado de un elemento como dict: `data` si salió bien, `error` y `status` si no"""
+    try:
+        return {key_field: key, "data": await load(key)}
+    except HTTPException as e:
+        return {key_field: key, "error": e.detail, "status": e.status_code}
+    except (Overloaded, UpstreamUnavailable) as e:
+        return {key_field: key, "error": str(e), "status": 503}
+    except Exception as e:
+        # El detalle queda en el log; al cliente no se le filtran errores internos
+        logger.error(f"Error en elemento de lote {key}: {e}")
+        return {key_field: key, "error": "Error interno", "status": 500}
+
+async def stream_batch(
+    keys: List[str],
+    load: Callable[[str], Awaitable[Any]],
+    key_field: str,
+    concurrency: int = None
+) -> AsyncIterator[bytes]:
+    """
+    Carga cada clave con `load` y emite una línea NDJSON por resultado, en
+    orden de término y no de llegada.
+    
+    Como máximo `concurrency` (BATCH_CONCURRENCY) cargas a la vez: un
+    grupo fijo de workers toma claves de una cola, así un lote grande no
+    crea una tarea por elemento. La cola de resultados está acotada, de
+    modo que un cliente lento frena a los workers en lugar de acumular
+    respuestas en memoria. Si el cliente se desconecta, el generador se
+    cierra y los workers se cancelan.
+    """
+    concurrency = max(1, min(concurrency or settings.BATCH_CONCURRENCY, len(keys) or 1))
+    pending: asyncio.Queue = asyncio.Queue()
+    for key in keys:
+        pending.put_nowait(key)
+    results: asyncio.Queue = asyncio.Queue(maxsize=concurrency * 2)
+    
+    async def worker():
+        while True:
+            try:
+                key = pending.get_nowait()
+            except asyncio.QueueEmpty:
+                return
+            await results.put(await _load_item(key_field, key, load))
+    
+    workers = [asyncio.ensure_future(worker()) for _ in range(concurrency)]
+    try:
+        for _ in range(len(keys)):
+            item = await results.get()
+            yield (json.dumps(item, ensure_ascii=False, default=str) + "\n").encode("utf-8")
+    finally:
+        for task in workers:
+            task.cancel()
@@ -0,0 +1,83 @@
+import asyncio
+from typing import Dict, Optional
+from utils.request_context import remaining
+import logging
+
+logger = logging.getLogger(__name__)
+
+class BulkheadFull(Exception):
+    """El compartimento del upstream está lleno; la llamada no se envió"""
+
+class Bulkhead:
+    """
+    Compartimento (bulkhead) de llamadas a un upstream.
+    
+    Acota las llamadas simultáneas (`max_concurrent`) y cuántas pueden
+    esperar turno (`max_queue`, hasta `queue_timeout` segundos o lo que
+    quede del deadline). Así un upstream lento agota solo su compartimento
+    y no los cupos, sockets ni tiempo del resto del middleware.
+    
+    Uso: `async with bulkhead: ...`
+    """
+    
+    def __init__(self, name: str, max_concurrent: int, max_queue: int, queue_timeout: float):
+        self.name = name
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self._semaphore = asyncio.Semaphore(max_concurrent)
+        self.active = 0
+        self.waiting = 0
+        self.rejected = 0
+    
+    async def __aenter__(self):
+        if self._semaphore.locked():
+            if self.waiting >= self.max_queue:
+                self._reject("cola llena")
+            
+            timeout = self.queue_timeout
+            left = remaining()
+            if left is not None:
+                timeout = min(timeout, left)
+            
+            self.waiting += 1
+            acquired = False
+            try:
+                async with asyncio.timeout(max(timeout, 0)):
+                    await self._semaphore.acquire()
+                    acquired = True
+            except TimeoutError:
+                # Si el cupo llegó justo cuando vencía la espera, se usa: rechazar
+                # aquí dejaría el permiso tomado sin que nadie lo libere
+                if not acquired:
+                    self._reject("espera vencida")
+            except BaseException:
+                if acquired:
+                    self._semaphore.release()
+                raise
+            finally:
+                self.waiting -= 1
+        else:
+            await self._semaphore.acquire()
+        
+        self.active += 1
+        return self
+    
+    async def __aexit__(self, exc_type, exc, tb) -> Optional[bool]:
+        self.active -= 1
+        self._semaphore.release()
+        return None
+    
+    def _reject(self, reason: str):
+        self.rejected += 1
+        logger.warning(f"Bulkhead '{self.name}': llamada rechazada ({reason})")
+        raise BulkheadFull(f"Bulkhead {self.name} lleno: {reason}")
+    
+    def stats(self) -> Dict:
+        return {
+            "active": self.active,
+            "waiting": self.waiting,
+            "max_concurrent": self.max_concurrent,
+            "max_queue": self.max_queue,
+            "rejected": self.rejected
+        }
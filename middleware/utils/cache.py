@@ -0,0 +1,122 @@
+import json
+import os
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Marca de "no está en caché" (None es un valor válido: entrada negativa)
+MISS = object()
+
+class LRUCache:
+    """
+    Caché LRU en memoria con TTL, tamaño acotado y caché negativa.
+
+    - set(): guarda un valor por `ttl` segundos
+    - set_negative(): recuerda que la clave no existe (p.ej. un 404) por
+      `negative_ttl` segundos; get() retorna None para esas claves
+    - get(): retorna el valor, None (negativa) o MISS
+    - dump()/load(): persistencia opcional en JSON de las entradas positivas
+
+    Todas las operaciones son síncronas y sin await, por lo que son atómicas
+    dentro del event loop y no necesitan lock.
+    """
+    
+    def __init__(self, name: str, max_size: int, ttl: float, negative_ttl: float = 0):
+        self.name = name
+        self.max_size = max_size
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self._entries: OrderedDict = OrderedDict()  # clave -> (valor, expira_en, negativa)
+        self.hits = 0
+        self.negative_hits = 0
+        self.misses = 0
+        self.evictions = 0
+    
+    def get(self, key: str) -> Any:
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return MISS
+        
+        value, expires_at, negative = entry
+        if expires_at <= time.time():
+            del self._entries[key]
+            self.misses += 1
+            return MISS
+        
+        self._entries.move_to_end(key)
+        if negative:
+            self.negative_hits += 1
+            return None
+        self.hits += 1
+        return value
+    
+    def set(self, key: str, value: Any):
+        self._store(key, value, self.ttl, negative=False)
+    
+    def set_negative(self, key: str):
+        if self.negative_ttl > 0:
+            self._store(key, None, self.negative_ttl, negative=True)
+    
+    def invalidate(self, key: str):
+        self._entries.pop(key, None)
+    
+    def _store(self, key: str, value: Any, ttl: float, negative: bool):
+        self._entries[key] = (value, time.time() + ttl, negative)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+    
+    def stats(self) -> Dict:
+        lookups = self.hits + self.negative_hits + self.misses
+        return {
+            "size": len(self._entries),
+            "max_size": self.max_size,
+            "hits": self.hits,
+            "negative_hits": self.negative_hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_ratio": round((self.hits + self.negative_hits) / lookups, 3) if lookups else None
+        }
+    
+    def dump(self, path: Optional[str]):
+        """Guarda las entradas positivas vigentes en un archivo JSON"""
+        if not path:
+            return
+        now = time.time()
+        data = {
+            key: [value, expires_at]
+            for key, (value, expires_at, negative) in self._entries.items()
+            if not negative and expires_at > now
+        }
+        try:
+            tmp_path = f"{path}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(data, f)
+            os.replace(tmp_path, path)
+            logger.info(f"Caché '{self.name}': {len(data)} entradas guardadas en {path}")
+        except OSError as e:
+            logger.warning(f"Caché '{self.name}': no se pudo guardar en {path}: {e}")
+    
+    def load(self, path: Optional[str]):
+        """Carga entradas vigentes desde un archivo JSON generado por dump()"""
+        if not path or not os.path.exists(path):
+            return
+        try:
+            with open(path, encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, ValueError) as e:
+            logger.warning(f"Caché '{self.name}': no se pudo cargar {path}: {e}")
+            return
+        
+        now = time.time()
+        for key, (value, expires_at) in data.items():
+            if expires_at > now:
+                self._entries[key] = (value, expires_at, False)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+        logger.info(f"Caché '{self.name}': {len(self._entries)} entradas cargadas desde {path}")
@@ -1,6 +1,7 @@
 import time
+import threading
 from enum import Enum
-from typing import Dict
+from typing import Dict, List, Optional
 from config import settings
 import logging
 
@@ -11,73 +12,210 @@ class CircuitState(Enum):
     OPEN = "open"      # Circuito abierto, rechaza peticiones
     HALF_OPEN = "half_open"  # Probando si el servicio se recuperó
 
+class _Bucket:
+    """Llamadas registradas durante un tramo de la ventana"""
+    
+    __slots__ = ("started", "calls", "failures", "slow")
+    
+    def __init__(self):
+        self.started = 0
+        self.calls = 0
+        self.failures = 0
+        self.slow = 0
+
 class CircuitBreaker:
     """
-    Implementación del patrón Circuit Breaker
+    Implementación del patrón Circuit Breaker con ventana deslizante.
+    
+    - CLOSED: cuenta llamadas, fallos y llamadas lentas en un anillo de
+      CIRCUIT_BREAKER_BUCKETS tramos que cubre CIRCUIT_BREAKER_WINDOW
+      segundos. Abre cuando hay al menos CIRCUIT_BREAKER_MIN_CALLS llamadas
+      y la tasa de fallos o de llamadas lentas supera su umbral
+    - OPEN: rechaza todo durante CIRCUIT_BREAKER_TIMEOUT segundos
+    - HALF_OPEN: deja pasar como máximo CIRCUIT_BREAKER_HALF_OPEN_PROBES
+      sondas a la vez; si todas tienen éxito cierra, al primer fallo abre.
+      Una sonda que no informa resultado en CIRCUIT_BREAKER_PROBE_TIMEOUT
+      segundos libera su cupo
+    
+    Seguro para llamadas concurrentes (todas las transiciones bajo lock).
     """
+    
     def __init__(self, name: str):
         self.name = name
         self.state = CircuitState.CLOSED
-        self.failure_count = 0
-        self.last_failure_time = None
-        self.success_count = 0
+        self.opened_at: Optional[float] = None
+        self._lock = threading.Lock()
+        self._bucket_width = settings.CIRCUIT_BREAKER_WINDOW / settings.CIRCUIT_BREAKER_BUCKETS
+        self._buckets: List[_Bucket] = [_Bucket() for _ in range(settings.CIRCUIT_BREAKER_BUCKETS)]
+        self._probes: List[float] = []  # instantes en que se prestó cada sonda en curso
+        self._probe_successes = 0
+        self.transitions: Dict[str, int] = {}
+        self.rejected = 0
     
-    def can_execute(self) -> bool:
-        """Verifica si se puede ejecutar una petición"""
-        if self.state == CircuitState.CLOSED:
-            return True
-        
-        if self.state == CircuitState.OPEN:
-            # Verificar si debemos intentar cerrar el circuito
-            if self.last_failure_time and \
-               (time.time() - self.last_failure_time) > settings.CIRCUIT_BREAKER_TIMEOUT:
-                logger.info(f"Circuit Breaker '{self.name}': Intentando HALF_OPEN")
-                self.state = CircuitState.HALF_OPEN
-                self.success_count = 0
-                return True
-            return False
+    def _bucket(self, now: float) -> _Bucket:
+        """Tramo del instante `now`, reiniciándolo si quedó de una vuelta anterior"""
+        slot = int(now // self._bucket_width)
+        bucket = self._buckets[slot % len(self._buckets)]
+        if bucket.started != slot:
+            bucket.started = slot
+            bucket.calls = bucket.failures = bucket.slow = 0
+        return bucket
+    
+    def _window(self, now: float) -> Dict[str, int]:
+        oldest = int(now // self._bucket_width) - len(self._buckets) + 1
+        totals = {"calls": 0, "failures": 0, "slow": 0}
+        for bucket in self._buckets:
+            if bucket.started >= oldest:
+                totals["calls"] += bucket.calls
+                totals["failures"] += bucket.failures
+                totals["slow"] += bucket.slow
+        return totals
+    
+    def _transition(self, state: CircuitState, reason: str):
+        key = f"{self.state.value}->{state.value}"
+        self.transitions[key] = self.transitions.get(key, 0) + 1
+        log = logger.error if state == CircuitState.OPEN else logger.info
+        log(f"Circuit Breaker '{self.name}': {state.value.upper()} ({reason})")
         
-        if self.state == CircuitState.HALF_OPEN:
+        self.state = state
+        self._probes.clear()
+        self._probe_successes = 0
+        if state == CircuitState.OPEN:
+            self.opened_at = time.monotonic()
+        elif state == CircuitState.CLOSED:
+            # Empezar la ventana de cero tras recuperarse
+            for bucket in self._buckets:
+                bucket.calls = bucket.failures = bucket.slow = 0
+    
+    def is_open(self) -> bool:
+        """Indica si el circuito rechaza peticiones ahora (sin reservar sonda)"""
+        with self._lock:
+            return self.state == CircuitState.OPEN and \
+                time.monotonic() - self.opened_at < settings.CIRCUIT_BREAKER_TIMEOUT
+    
+    def accepts(self) -> bool:
+        """
+        Indica si can_execute aceptaría una petición ahora, sin reservar
+        sonda: en HALF_OPEN (o OPEN ya vencido) solo si queda cupo de sonda
+        """
+        with self._lock:
+            now = time.monotonic()
+            if self.state == CircuitState.OPEN:
+                return now - self.opened_at >= settings.CIRCUIT_BREAKER_TIMEOUT
+            if self.state == CircuitState.HALF_OPEN:
+                probes = [t for t in self._probes if now - t < settings.CIRCUIT_BREAKER_PROBE_TIMEOUT]
+                return len(probes) < settings.CIRCUIT_BREAKER_HALF_OPEN_PROBES
+            return True
+    
+    def can_execute(self) -> bool:
+        """
+        Verifica si se puede ejecutar una petición. En HALF_OPEN reserva un
+        cupo de sonda que se libera con record_success, record_failure o
+        release.
+        """
+        with self._lock:
+            now = time.monotonic()
+            if self.state == CircuitState.OPEN:
+                if now - self.opened_at < settings.CIRCUIT_BREAKER_TIMEOUT:
+                    self.rejected += 1
+                    return False
+                self._transition(CircuitState.HALF_OPEN, "probando recuperación")
+            
+            if self.state == CircuitState.HALF_OPEN:
+                self._probes = [t for t in self._probes if now - t < settings.CIRCUIT_BREAKER_PROBE_TIMEOUT]
+                if len(self._probes) >= settings.CIRCUIT_BREAKER_HALF_OPEN_PROBES:
+                    self.rejected += 1
+                    return False
+                self._probes.append(now)
+            
             return True
-        
-        return False
-    
-    def record_success(self):
-        """Registra una ejecución exitosa"""
-        if self.state == CircuitState.HALF_OPEN:
-            self.success_count += 1
-            # Si tenemos varios éxitos, cerramos el circuito
-            if self.success_count >= 2:
-                logger.info(f"Circuit Breaker '{self.name}': CLOSED (recuperado)")
-                self.state = CircuitState.CLOSED
-                self.failure_count = 0
-        else:
-            self.failure_count = 0
+    
+    def _release_probe(self):
+        if self._probes:
+            self._probes.pop(0)
+    
+    def release(self):
+        """Libera un cupo de sonda sin registrar resultado (llamada cancelada o sin veredicto)"""
+        with self._lock:
+            if self.state == CircuitState.HALF_OPEN:
+                self._release_probe()
+    
+    def record_success(self, duration: Optional[float] = None):
+        """Registra una ejecución exitosa; `duration` (segundos) permite detectar llamadas lentas"""
+        with self._lock:
+            now = time.monotonic()
+            slow = duration is not None and duration >= settings.CIRCUIT_BREAKER_SLOW_CALL_DURATION
+            
+            if self.state == CircuitState.HALF_OPEN:
+                self._release_probe()
+                if slow:
+                    self._transition(CircuitState.OPEN, f"sonda lenta ({duration:.2f}s)")
+                    return
+                self._probe_successes += 1
+                if self._probe_successes >= settings.CIRCUIT_BREAKER_HALF_OPEN_PROBES:
+                    self._transition(CircuitState.CLOSED, "recuperado")
+                return
+            
+            bucket = self._bucket(now)
+            bucket.calls += 1
+            if slow:
+                bucket.slow += 1
+                self._evaluate(now)
     
     def record_failure(self):
         """Registra una ejecución fallida"""
-        self.failure_count += 1
-        self.last_failure_time = time.time()
+        with self._lock:
+            now = time.monotonic()
+            if self.state == CircuitState.HALF_OPEN:
+                self._release_probe()
+                self._transition(CircuitState.OPEN, "falló en HALF_OPEN")
+                return
+            
+            bucket = self._bucket(now)
+            bucket.calls += 1
+            bucket.failures += 1
+            self._evaluate(now)
+    
+    def _evaluate(self, now: float):
+        if self.state != CircuitState.CLOSED:
+            return
+        window = self._window(now)
+        calls = window["calls"]
+        if calls < settings.CIRCUIT_BREAKER_MIN_CALLS:
+            return
         
-        if self.state == CircuitState.HALF_OPEN:
-            logger.warning(f"Circuit Breaker '{self.name}': OPEN (falló en HALF_OPEN)")
-            self.state = CircuitState.OPEN
-        elif self.failure_count >= settings.CIRCUIT_BREAKER_THRESHOLD:
-            logger.error(
-                f"Circuit Breaker '{self.name}': OPEN "
-                f"({self.failure_count} fallos consecutivos)"
-            )
-            self.state = CircuitState.OPEN
+        failure_rate = window["failures"] / calls
+        slow_rate = window["slow"] / calls
+        if failure_rate >= settings.CIRCUIT_BREAKER_FAILURE_RATE:
+            self._transition(CircuitState.OPEN, f"{failure_rate:.0%} de fallos en {calls} llamadas")
+        elif slow_rate >= settings.CIRCUIT_BREAKER_SLOW_CALL_RATE:
+            self._transition(CircuitState.OPEN, f"{slow_rate:.0%} de llamadas lentas en {calls} llamadas")
     
     def get_state(self) -> str:
         return self.state.value
+    
+    def stats(self) -> Dict:
+        with self._lock:
+            window = self._window(time.monotonic())
+            calls = window["calls"]
+            return {
+                "state": self.state.value,
+                "window_calls": calls,
+                "failure_rate": round(window["failures"] / calls, 4) if calls else 0.0,
+                "slow_call_rate": round(window["slow"] / calls, 4) if calls else 0.0,
+                "probes_in_flight": len(self._probes),
+                "rejected": self.rejected,
+                "transitions": dict(self.transitions)
+            }
 
-# Instancias globales de Circuit Breakers
-circuit_breakers: Dict[str, CircuitBreaker] = {
-    "app1": CircuitBreaker("app1"),
-    "app2": CircuitBreaker("app2")
-}
+# Registro global de Circuit Breakers (uno por servicio o endpoint)
+circuit_breakers: Dict[str, CircuitBreaker] = {}
+_registry_lock = threading.Lock()
 
 def get_circuit_breaker(service: str) -> CircuitBreaker:
-    """Obtiene el Circuit Breaker para un servicio"""
-    return circuit_breakers.get(service, CircuitBreaker(service))
+    """Obtiene (o registra) el Circuit Breaker de un servicio o endpoint"""
+    with _registry_lock:
+        breaker = circuit_breakers.get(service)
+        if breaker is None:
+            breaker = circuit_breakers[service] = CircuitBreaker(service)
+        return breaker
@@ -0,0 +1,167 @@
+import time
+import asyncio
+import httpx
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import Dict
+from config import settings
+from utils.load_balancer import is_endpoint_failure
+from utils.request_context import remaining
+import logging
+
+logger = logging.getLogger(__name__)
+
+class Overloaded(Exception):
+    """No hay cupo de concurrencia para el upstream; la petición se descarta"""
+    
+    def __init__(self, message: str, retry_after: int):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+class AdaptiveLimiter:
+    """
+    Límite de concurrencia adaptativo (AIMD) por upstream.
+    
+    - Aumento aditivo: cada respuesta rápida suma 1/limit (≈ +1 por cada
+      `limit` respuestas), hasta LIMITER_MAX
+    - Disminución multiplicativa: una respuesta lenta (más de
+      LIMITER_TOLERANCE veces la latencia mínima reciente, y sobre
+      LIMITER_LATENCY_FLOOR) o un error multiplica el límite por
+      LIMITER_BACKOFF, como máximo una vez por intervalo de latencia mínima
+    - Lo que excede el límite espera en cola hasta LIMITER_QUEUE_TIMEOUT
+      (o lo que quede del deadline); si la cola está llena o la espera vence
+      se descarta con Overloaded
+    
+    Los clientes lo aplican solo a la llamada HTTP real (ver slot()): las
+    respuestas servidas desde caché no pasan por el limitador ni aportan
+    latencias, que de otro modo llevarían la latencia mínima casi a cero.
+    """
+    
+    def __init__(self, name: str):
+        self.name = name
+        self.limit = float(settings.LIMITER_INITIAL)
+        self.in_flight = 0
+        self._waiters: deque = deque()
+        self._min_rtt = None
+        self._min_rtt_reset_at = time.monotonic() + settings.LIMITER_MIN_RTT_WINDOW
+        self._last_decrease = 0.0
+        self._stats = {"admitted": 0, "queued": 0, "shed": 0, "decreases": 0}
+    
+    async def acquire(self):
+        """Reserva un cupo, esperando en cola si hace falta"""
+        if self.in_flight < int(self.limit) and not self._waiters:
+            self.in_flight += 1
+            self._stats["admitted"] += 1
+            return
+        
+        if len(self._waiters) >= settings.LIMITER_QUEUE_SIZE:
+            self._shed("cola llena")
+        
+        timeout = settings.LIMITER_QUEUE_TIMEOUT
+        left = remaining()
+        if left is not None:
+            timeout = min(timeout, left)
+        
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        self._stats["queued"] += 1
+        try:
+            await asyncio.wait_for(asyncio.shield(waiter), timeout=max(timeout, 0))
+        except asyncio.TimeoutError:
+            if not (waiter.done() and not waiter.cancelled()):
+                self._shed("espera en cola vencida")
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled():
+                # Ya se le había traspasado un cupo: devolverlo
+                self.release()
+            raise
+        finally:
+            if not waiter.done():
+                waiter.cancel()
+            try:
+                self._waiters.remove(waiter)
+            except ValueError:
+                pass
+        self._stats["admitted"] += 1
+    
+    def _shed(self, reason: str):
+        self._stats["shed"] += 1
+        retry_after = max(1, int(round(self._min_rtt or 1)))
+        logger.warning(f"Limiter '{self.name}': petición descartada ({reason}; límite {int(self.limit)})")
+        raise Overloaded(f"{self.name} sobrecargado: {reason}", retry_after)
+    
+    def release(self):
+        """Libera un cupo y lo traspasa al siguiente en cola si cabe"""
+        self.in_flight -= 1
+        while self._waiters and self.in_flight < int(self.limit):
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                self.in_flight += 1
+                waiter.set_result(None)
+    
+    def record(self, latency: float, failed: bool = False):
+        """Ajusta el límite con la latencia (segundos) de una petición terminada"""
+        now = time.monotonic()
+        if now >= self._min_rtt_reset_at:
+            # La latencia base se re-aprende periódicamente
+            self._min_rtt = None
+            self._min_rtt_reset_at = now + settings.LIMITER_MIN_RTT_WINDOW
+        if not failed and (self._min_rtt is None or latency < self._min_rtt):
+            self._min_rtt = latency
+        
+        threshold = max((self._min_rtt or latency) * settings.LIMITER_TOLERANCE, settings.LIMITER_LATENCY_FLOOR)
+        if failed or latency > threshold:
+            if now - self._last_decrease >= max(self._min_rtt or 0, 0.1):
+                self._last_decrease = now
+                self._stats["decreases"] += 1
+                self.limit = max(settings.LIMITER_MIN, self.limit * settings.LIMITER_BACKOFF)
+        else:
+            self.limit = min(settings.LIMITER_MAX, self.limit + 1 / self.limit)
+    
+    @asynccontextmanager
+    async def slot(self):
+        """
+        Cupo para una llamada upstream: `async with limiter.slot(): ...`.
+        
+        La latencia va desde la admisión hasta el fin del bloque (incluye la
+        espera en el bulkhead: un compartimento saturado también es señal
+        para bajar el límite). Cuentan como error los de la instancia (red,
+        timeouts, 5xx); un 4xx es una respuesta normal. Una llamada cancelada,
+        sin deadline o rechazada por el bulkhead no ajusta el límite.
+        """
+        if not settings.LIMITER_ENABLED:
+            yield
+            return
+        
+        await self.acquire()
+        started = time.monotonic()
+        try:
+            yield
+        except httpx.HTTPStatusError as e:
+            self.record(time.monotonic() - started, is_endpoint_failure(e))
+            raise
+        except Exception as e:
+            if is_endpoint_failure(e):
+                self.record(time.monotonic() - started, failed=True)
+            raise
+        else:
+            self.record(time.monotonic() - started)
+        finally:
+            self.release()
+    
+    def stats(self) -> Dict:
+        return {
+            "limit": int(self.limit),
+            "in_flight": self.in_flight,
+            "queued_now": len(self._waiters),
+            "min_rtt_ms": round(self._min_rtt * 1000, 2) if self._min_rtt is not None else None,
+            **self._stats
+        }
+
+limiters: Dict[str, AdaptiveLimiter] = {}
+
+def get_limiter(upstream: str) -> AdaptiveLimiter:
+    limiter = limiters.get(upstream)
+    if limiter is None:
+        limiter = limiters[upstream] = AdaptiveLimiter(upstream)
+    return limiter
@@ -0,0 +1,20 @@
+from typing import Any
+
+class UpstreamUnavailable(Exception):
+    """
+    El upstream no respondió y el cliente tuvo que degradar la respuesta.
+    
+    Se lanza solo cuando el llamador pide `fallback=False`; `fallback`
+    lleva la respuesta degradada que el cliente habría retornado, para que
+    el llamador decida si usarla o servir algo mejor (p.ej. un dato en caché).
+    """
+    
+    def __init__(self, message: str, fallback: Any = None):
+        super().__init__(message)
+        self.fallback = fallback
+
+class CircuitOpenError(Exception):
+    """El circuit breaker del destino está abierto; la petición no se envió"""
+
+class DeadlineExceeded(Exception):
+    """Se agotó el deadline de la petición entrante; no tiene sentido seguir llamando upstream"""
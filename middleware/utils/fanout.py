@@ -0,0 +1,53 @@
+import asyncio
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+import logging
+
+logger = logging.getLogger(__name__)
+
+async def fan_out(
+    branches: Dict[str, Callable[[], Awaitable[Any]]],
+    deadline: float,
+    defaults: Optional[Dict[str, Any]] = None
+) -> Tuple[Dict[str, Any], Dict[str, str]]:
+    """
+    Ejecuta llamadas upstream independientes en paralelo bajo un deadline común.
+
+    Cada rama se declara como nombre -> función sin argumentos que retorna
+    el awaitable. Las ramas que fallan o no terminan antes del deadline se
+    cancelan y toman su valor de `defaults` (resultado parcial).
+
+    Returns:
+        (resultados por rama, errores por rama)
+    """
+    defaults = defaults or {}
+    tasks = {name: asyncio.ensure_future(factory()) for name, factory in branches.items()}
+    
+    try:
+        done, pending = await asyncio.wait(tasks.values(), timeout=deadline)
+    except asyncio.CancelledError:
+        # El llamador fue cancelado: no dejar ramas huérfanas
+        for task in tasks.values():
+            task.cancel()
+        raise
+    
+    for task in pending:
+        task.cancel()
+    
+    results: Dict[str, Any] = {}
+    errors: Dict[str, str] = {}
+    for name, task in tasks.items():
+        if task in pending:
+            errors[name] = f"deadline de {deadline}s excedido"
+        elif task.exception() is not None:
+            exc = task.exception()
+            errors[name] = (str(exc).splitlines() or [type(exc).__name__])[0]
+        else:
+            results[name] = task.result()
+            continue
+        logger.warning(f"Rama '{name}' sin resultado: {errors[name]}")
+        results[name] = defaults.get(name)
+    
+    if pending:
+        await asyncio.gather(*pending, return_exceptions=True)
+    
+    return results, errors
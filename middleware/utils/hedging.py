@@ -0,0 +1,121 @@
+import asyncio
+import time
+from collections import deque
+from typing import Any, Awaitable, Callable, Dict, Optional
+from config import settings
+import logging
+
+logger = logging.getLogger(__name__)
+
+class Hedger:
+    """
+    Peticiones con cobertura (hedged requests) para lecturas idempotentes.
+    
+    Lanza la petición principal y, si no responde dentro de un retraso
+    igual al percentil HEDGE_PERCENTILE de sus latencias recientes, lanza
+    la misma lectura contra el destino alternativo y se queda con el primer
+    éxito (la otra se cancela).
+    
+    - El retraso se ajusta solo a partir de una ventana de latencias del
+      principal; mientras no hay muestras suficientes usa HEDGE_INITIAL_DELAY
+    - Presupuesto: cada petición aporta HEDGE_BUDGET_RATIO fichas y cada
+      cobertura consume una, así las coberturas no superan esa fracción del
+      tráfico aunque el principal se degrade por completo
+    - Métricas: tasa de cobertura y tasa de victorias del alternativo
+    """
+    
+    def __init__(self, name: str):
+        self.name = name
+        self._latencies: deque = deque(maxlen=settings.HEDGE_LATENCY_WINDOW)
+        self._tokens = settings.HEDGE_BUDGET_BURST
+        self._stats = {
+            "requests": 0,
+            "hedged": 0,
+            "hedge_wins": 0,
+            "budget_exhausted": 0
+        }
+    
+    def delay(self) -> float:
+        """Retraso actual antes de lanzar la cobertura (segundos)"""
+        if len(self._latencies) < settings.HEDGE_MIN_SAMPLES:
+            return settings.HEDGE_INITIAL_DELAY
+        ordered = sorted(self._latencies)
+        index = min(len(ordered) - 1, int(len(ordered) * settings.HEDGE_PERCENTILE / 100))
+        return max(settings.HEDGE_MIN_DELAY, ordered[index])
+    
+    def _take_token(self) -> bool:
+        if self._tokens >= 1:
+            self._tokens -= 1
+            return True
+        self._stats["budget_exhausted"] += 1
+        return False
+    
+    async def run(self, primary: Callable[[], Awaitable[Any]], alternate: Callable[[], Awaitable[Any]]) -> Any:
+        """
+        Ejecuta primary() con cobertura en alternate().
+        
+        Si primary() falla antes del retraso la excepción se propaga sin
+        cobertura (de los fallos se encarga retry_with_backoff).
+        """
+        self._stats["requests"] += 1
+        self._tokens = min(settings.HEDGE_BUDGET_BURST, self._tokens + settings.HEDGE_BUDGET_RATIO)
+        
+        started = time.monotonic()
+        primary_task = asyncio.ensure_future(primary())
+        primary_task.add_done_callback(lambda task: self._record_primary(task, started))
+        
+        delay = self.delay()
+        try:
+            done, _ = await asyncio.wait({primary_task}, timeout=delay)
+            if done or not self._take_token():
+                return await primary_task
+            
+            self._stats["hedged"] += 1
+            logger.info(f"Hedge '{self.name}': principal sin respuesta tras {delay:.3f}s, lanzando alternativo")
+            alternate_task = asyncio.ensure_future(alternate())
+            return await self._first_success(primary_task, alternate_task, started)
+        except asyncio.CancelledError:
+            primary_task.cancel()
+            raise
+    
+    def _record_primary(self, task: asyncio.Future, started: float):
+        """Latencia del principal cuando termina bien (gane o no la carrera)"""
+        if not task.cancelled() and task.exception() is None:
+            self._latencies.append(time.monotonic() - started)
+    
+    async def _first_success(self, primary_task: asyncio.Task, alternate_task: asyncio.Task, started: float) -> Any:
+        """Retorna el primer resultado exitoso y cancela la petición perdedora"""
+        pending = {primary_task, alternate_task}
+        error: Optional[BaseException] = None
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is not None:
+                        # Se propaga el error del principal si ambos fallan
+                        if error is None or task is primary_task:
+                            error = task.exception()
+                        continue
+                    if task is not primary_task:
+                        self._stats["hedge_wins"] += 1
+                        if primary_task in pending:
+                            # El principal pierde y se cancela: su latencia es al menos
+                            # lo transcurrido. Sin esta muestra la ventana solo vería
+                            # las respuestas rápidas y el retraso se iría achicando
+                            self._latencies.append(time.monotonic() - started)
+                    return task.result()
+            raise error
+        finally:
+            for task in pending:
+                task.cancel()
+    
+    def stats(self) -> Dict:
+        requests = self._stats["requests"]
+        hedged = self._stats["hedged"]
+        return {
+            **self._stats,
+            "delay": round(self.delay(), 4),
+            "hedge_rate": round(hedged / requests, 4) if requests else 0.0,
+            "win_rate": round(self._stats["hedge_wins"] / hedged, 4) if hedged else 0.0,
+            "budget_tokens": round(self._tokens, 2)
+        }
@@ -0,0 +1,41 @@
+import httpx
+from typing import Dict, Optional, Tuple
+from config import settings
+from utils.metrics import InstrumentedTransport
+
+def create_http_client(
+    max_connections: Optional[int] = None,
+    max_keepalive_connections: Optional[int] = None,
+    metrics_labels: Optional[Tuple[str, str]] = None
+) -> httpx.AsyncClient:
+    """
+    Crea un httpx.AsyncClient de larga vida con pool de conexiones keep-alive.
+    Se usa uno por host upstream, así los límites del pool son por host;
+    cada cliente (App1, App2) puede pasar sus propios límites.
+    Con `metrics_labels` (upstream, instancia) cada petición queda en /metrics.
+    """
+    limits = httpx.Limits(
+        max_connections=max_connections or settings.HTTP_MAX_CONNECTIONS_PER_HOST,
+        max_keepalive_connections=max_keepalive_connections or settings.HTTP_MAX_KEEPALIVE_CONNECTIONS,
+        keepalive_expiry=settings.HTTP_KEEPALIVE_EXPIRY
+    )
+    transport = httpx.AsyncHTTPTransport(limits=limits, http2=settings.HTTP2_ENABLED)
+    if metrics_labels is not None:
+        transport = InstrumentedTransport(transport, *metrics_labels)
+    return httpx.AsyncClient(timeout=settings.REQUEST_TIMEOUT, transport=transport)
+
+def http_pool_stats(client: httpx.AsyncClient) -> Dict:
+    """Ocupación del pool de conexiones de un cliente (para /status)"""
+    transport = getattr(client._transport, "inner", client._transport)
+    pool = getattr(transport, "_pool", None)
+    connections = list(getattr(pool, "connections", []))
+    idle = sum(1 for conn in connections if conn.is_idle())
+    return {
+        "connections": len(connections),
+        "active": len(connections) - idle,
+        "idle": idle,
+        "max_connections": getattr(pool, "_max_connections", None),
+        "max_keepalive_connections": getattr(pool, "_max_keepalive_connections", None),
+        "http2": settings.HTTP2_ENABLED,
+        "closed": client.is_closed
+    }
@@ -0,0 +1,209 @@
+import json
+import asyncio
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timezone
+from typing import Any, Dict, Optional, Tuple
+from config import settings
+import logging
+
+logger = logging.getLogger(__name__)
+
+class LastKnownGoodStore:
+    """
+    Última respuesta buena (ya transformada) por clave, para servirla marcada
+    como `stale` cuando el upstream está caído en lugar de datos inventados.
+    
+    Mantiene hasta `max_entries` en memoria (LRU). Si se configura
+    `spill_path`, las entradas desalojadas se vuelcan a SQLite (hasta
+    `spill_max_entries`) y se siguen pudiendo leer; al cerrar se vuelca
+    también la memoria, así sobreviven a un reinicio.
+    
+    SQLite no bloquea el event loop: las entradas desalojadas se acumulan
+    y se escriben en lotes de LKG_SPILL_BATCH en un hilo del executor (una
+    transacción por lote), y mientras esperan siguen legibles. Las lecturas
+    que no están en memoria también van a un hilo (get es async), porque
+    se concentran justo durante una caída del upstream.
+    """
+    
+    def __init__(self, max_entries: int, spill_path: Optional[str] = None, spill_max_entries: int = 0):
+        self.max_entries = max_entries
+        self.spill_max_entries = spill_max_entries
+        self._memory: OrderedDict = OrderedDict()  # clave -> (valor, registrado_en)
+        self._db: Optional[sqlite3.Connection] = None
+        self._db_lock = threading.Lock()
+        self._pending: Dict[str, Tuple[Any, float]] = {}  # desalojadas, aún sin volcar
+        self._flushing = False
+        self._spilled_since_prune = 0
+        self.hits = 0
+        self.spill_hits = 0
+        self.misses = 0
+        
+        if spill_path:
+            try:
+                self._db = sqlite3.connect(spill_path, check_same_thread=False)
+                self._db.execute(
+                    "CREATE TABLE IF NOT EXISTS last_known_good ("
+                    "key TEXT PRIMARY KEY, value TEXT NOT NULL, recorded_at REAL NOT NULL)"
+                )
+                self._db.commit()
+            except sqlite3.Error as e:
+                logger.warning(f"Last-known-good: SQLite deshabilitado ({spill_path}): {e}")
+                self._db = None
+    
+    def record(self, key: str, value: Any):
+        """Registra una respuesta exitosa"""
+        self._memory[key] = (value, time.time())
+        self._memory.move_to_end(key)
+        self._pending.pop(key, None)
+        while len(self._memory) > self.max_entries:
+            old_key, entry = self._memory.popitem(last=False)
+            if self._db is not None:
+                self._pending[old_key] = entry
+        if len(self._pending) >= settings.LKG_SPILL_BATCH and not self._flushing:
+            self._schedule_flush()
+    
+    async def get(self, key: str) -> Optional[Dict]:
+        """Retorna {"value", "recorded_at"} o None"""
+        entry = self._memory.get(key)
+        if entry is not None:
+            self.hits += 1
+            return {"value": entry[0], "recorded_at": entry[1]}
+        
+        entry = self._pending.get(key)
+        if entry is not None:
+            self.spill_hits += 1
+            return {"value": entry[0], "recorded_at": entry[1]}
+        
+        if self._db is not None:
+            entry = await asyncio.to_thread(self._read_spilled, key)
+            if entry is not None:
+                self.spill_hits += 1
+                return entry
+        
+        self.misses += 1
+        return None
+    
+    def _read_spilled(self, key: str) -> Optional[Dict]:
+        """Lee una entrada volcada a SQLite (corre en un hilo, ver get)"""
+        try:
+            with self._db_lock:
+                if self._db is None:
+                    return None
+                row = self._db.execute(
+                    "SELECT value, recorded_at FROM last_known_good WHERE key = ?", (key,)
+                ).fetchone()
+        except sqlite3.Error as e:
+            logger.warning(f"Last-known-good: lectura de SQLite falló: {e}")
+            return None
+        if row is None:
+            return None
+        return {"value": json.loads(row[0]), "recorded_at": row[1]}
+    
+    async def get_stale(self, key: str) -> Any:
+        """Última respuesta buena marcada como stale, o None si no hay"""
+        entry = await self.get(key)
+        if entry is None:
+            return None
+        
+        stale_since = datetime.fromtimestamp(entry["recorded_at"], tz=timezone.utc).isoformat()
+        value = entry["value"]
+        if isinstance(value, dict):
+            return {**value, "stale": True, "stale_since": stale_since}
+        if isinstance(value, list):
+            return [
+                {**item, "stale": True, "stale_since": stale_since} if isinstance(item, dict) else item
+                for item in value
+            ]
+        return value
+    
+    def _schedule_flush(self):
+        """Vuelca las entradas pendientes en un hilo del executor"""
+        batch = dict(self._pending)
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            self._spill(batch)
+            self._forget(batch)
+            return
+        
+        self._flushing = True
+        
+        def done(_future):
+            self._flushing = False
+            self._forget(batch)
+        
+        loop.run_in_executor(None, self._spill, batch).add_done_callback(done)
+    
+    def _forget(self, batch: Dict[str, Tuple[Any, float]]):
+        """Quita de pendientes lo ya volcado (salvo lo que se volvió a desalojar después)"""
+        for key, entry in batch.items():
+            if self._pending.get(key) is entry:
+                del self._pending[key]
+    
+    def _spill(self, batch: Dict[str, Tuple[Any, float]]):
+        rows = []
+        for key, (value, recorded_at) in batch.items():
+            try:
+                rows.append((key, json.dumps(value), recorded_at))
+            except (TypeError, ValueError) as e:
+                logger.warning(f"Last-known-good: no se pudo volcar {key} a SQLite: {e}")
+        
+        with self._db_lock:
+            if self._db is None or not rows:
+                return
+            try:
+                self._db.executemany(
+                    "INSERT OR REPLACE INTO last_known_good (key, value, recorded_at) VALUES (?, ?, ?)",
+                    rows
+                )
+                self._spilled_since_prune += len(rows)
+                if self._spilled_since_prune >= 100:
+                    self._prune()
+                self._db.commit()
+            except sqlite3.Error as e:
+                logger.warning(f"Last-known-good: no se pudo volcar un lote de {len(rows)} entradas a SQLite: {e}")
+    
+    def _prune(self):
+        """Deja en SQLite solo las `spill_max_entries` entradas más recientes"""
+        self._spilled_since_prune = 0
+        self._db.execute(
+            "DELETE FROM last_known_good WHERE key NOT IN ("
+            "SELECT key FROM last_known_good ORDER BY recorded_at DESC LIMIT ?)",
+            (self.spill_max_entries,)
+        )
+    
+    def close(self):
+        """Vuelca pendientes y memoria a SQLite (si está configurado) y cierra"""
+        if self._db is None:
+            return
+        self._spill({**self._pending, **self._memory})
+        self._pending.clear()
+        with self._db_lock:
+            try:
+                self._prune()
+                self._db.commit()
+                self._db.close()
+            except sqlite3.Error as e:
+                logger.warning(f"Last-known-good: error cerrando SQLite: {e}")
+            self._db = None
+    
+    def stats(self) -> Dict:
+        return {
+            "memory_entries": len(self._memory),
+            "max_entries": self.max_entries,
+            "spill_enabled": self._db is not None,
+            "spill_pending": len(self._pending),
+            "hits": self.hits,
+            "spill_hits": self.spill_hits,
+            "misses": self.misses
+        }
+
+# Almacén compartido por los clientes de App1 y App2
+last_known_good = LastKnownGoodStore(
+    settings.LKG_MAX_ENTRIES,
+    spill_path=settings.LKG_SPILL_PATH or None,
+    spill_max_entries=settings.LKG_SPILL_MAX_ENTRIES
+)
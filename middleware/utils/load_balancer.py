@@ -0,0 +1,122 @@
+import random
+import time
+import asyncio
+import httpx
+from contextlib import asynccontextmanager
+from typing import Callable, Dict, List, Optional
+from config import settings
+import logging
+
+logger = logging.getLogger(__name__)
+
+class Endpoint:
+    """Una instancia upstream con su latencia EWMA y peticiones en curso"""
+    
+    def __init__(self, url: str):
+        self.url = url
+        self.ewma: Optional[float] = None  # segundos; None hasta la primera respuesta
+        self.observed_at = 0.0
+        self.in_flight = 0
+        self.requests = 0
+        self.errors = 0
+    
+    def observe(self, latency: float):
+        alpha = settings.LB_EWMA_ALPHA
+        self.ewma = latency if self.ewma is None else alpha * latency + (1 - alpha) * self.ewma
+        self.observed_at = time.monotonic()
+    
+    def score(self) -> float:
+        """Costo esperado de enviarle una petición más (menor es mejor)"""
+        # Sin muestras recientes se asume rápido para que reciba tráfico y se
+        # vuelva a medir (así un endpoint penalizado puede recuperarse)
+        stale = time.monotonic() - self.observed_at > settings.LB_PROBE_INTERVAL
+        ewma = 0.0 if self.ewma is None or stale else self.ewma
+        return (ewma + 0.001) * (self.in_flight + 1)
+    
+    def stats(self) -> Dict:
+        return {
+            "ewma_ms": round(self.ewma * 1000, 2) if self.ewma is not None else None,
+            "in_flight": self.in_flight,
+            "requests": self.requests,
+            "errors": self.errors
+        }
+
+def is_endpoint_failure(error: BaseException) -> bool:
+    """
+    Indica si un error es culpa de la instancia: errores de red, timeouts y
+    5xx. Un 4xx, un deadline agotado del llamador o un bulkhead local lleno
+    no dicen nada de la instancia y no la penalizan.
+    """
+    if isinstance(error, httpx.HTTPStatusError):
+        return error.response.status_code >= 500
+    return isinstance(error, (httpx.TransportError, asyncio.TimeoutError))
+
+class LoadBalancer:
+    """
+    Balanceo de lecturas entre instancias equivalentes según latencia.
+    
+    Cada endpoint lleva una latencia EWMA y su número de peticiones en
+    curso. Estrategias (LB_STRATEGY):
+    - "p2c": power-of-two-choices, se sortean dos endpoints y se elige el
+      de menor costo (EWMA × en curso); evita que todos corran al mismo
+    - "least_outstanding": el de menos peticiones en curso
+    Un error de la instancia (ver is_endpoint_failure) cuenta como una
+    respuesta de LB_ERROR_PENALTY segundos, así un endpoint caído deja de
+    recibir tráfico hasta que vuelve a responder.
+    Los endpoints que `available` descarta (p. ej. con el circuito abierto)
+    solo se eligen si no queda ninguno disponible.
+    """
+    
+    def __init__(self, name: str, urls: List[str], available: Optional[Callable[[Endpoint], bool]] = None):
+        self.name = name
+        # Sin duplicados y conservando el orden (el primero es el primary)
+        self.endpoints = [Endpoint(url) for url in dict.fromkeys(urls)]
+        self.available = available
+    
+    def pick(self, exclude: Optional[Endpoint] = None) -> Optional[Endpoint]:
+        """Elige un endpoint; None si no queda ninguno fuera de `exclude`"""
+        candidates = [ep for ep in self.endpoints if ep is not exclude]
+        if not candidates:
+            return None
+        if self.available is not None:
+            candidates = [ep for ep in candidates if self.available(ep)] or candidates
+        if len(candidates) == 1:
+            return candidates[0]
+        
+        if settings.LB_STRATEGY == "least_outstanding":
+            return min(candidates, key=lambda ep: (ep.in_flight, ep.score()))
+        
+        first, second = random.sample(candidates, 2)
+        return first if first.score() <= second.score() else second
+    
+    @asynccontextmanager
+    async def track(self, endpoint: Endpoint):
+        """Contabiliza una petición a `endpoint` (en curso, latencia, errores)"""
+        endpoint.in_flight += 1
+        endpoint.requests += 1
+        started = time.monotonic()
+        try:
+            yield endpoint
+        except httpx.HTTPStatusError as e:
+            if is_endpoint_failure(e):
+                endpoint.errors += 1
+                endpoint.observe(settings.LB_ERROR_PENALTY)
+            else:
+                # La instancia respondió (4xx): su latencia es una muestra válida
+                endpoint.observe(time.monotonic() - started)
+            raise
+        except Exception as e:
+            if is_endpoint_failure(e):
+                endpoint.errors += 1
+                endpoint.observe(settings.LB_ERROR_PENALTY)
+            raise
+        else:
+            endpoint.observe(time.monotonic() - started)
+        finally:
+            endpoint.in_flight -= 1
+    
+    def stats(self) -> Dict:
+        return {
+            "strategy": settings.LB_STRATEGY,
+            "endpoints": {ep.url: ep.stats() for ep in self.endpoints}
+        }
@@ -0,0 +1,187 @@
+import time
+import asyncio
+import httpx
+from abc import ABC, abstractmethod
+from bisect import bisect_left
+from typing import Callable, Dict, Iterable, List, Tuple
+
+# Límites de los buckets de latencia (segundos)
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+# Una muestra exportada: (nombre, etiquetas, valor)
+Sample = Tuple[str, Dict[str, str], float]
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _format_labels(labels: Dict[str, str]) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{_escape(value)}"' for key, value in labels.items()) + "}"
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) and not value.is_integer() else str(int(value))
+
+class _Metric(ABC):
+    """
+    Base de las métricas. Los valores viven en dicts por tupla de etiquetas
+    y se actualizan sin locks: el middleware corre en un solo event loop y
+    cada actualización es una operación sin await entre lectura y escritura.
+    Cada tipo concreto implementa samples(); sin ella no se puede instanciar.
+    """
+    
+    kind = "untyped"
+    
+    def __init__(self, name: str, help_text: str, labelnames: Iterable[str] = ()):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+    
+    def _labels(self, values: Tuple) -> Dict[str, str]:
+        return dict(zip(self.labelnames, values))
+    
+    @abstractmethod
+    def samples(self) -> List[Sample]:
+        """Muestras actuales para la exposición"""
+
+class Counter(_Metric):
+    kind = "counter"
+    
+    def __init__(self, name: str, help_text: str, labelnames: Iterable[str] = ()):
+        super().__init__(name, help_text, labelnames)
+        self._values: Dict[Tuple, float] = {}
+    
+    def inc(self, *labels, amount: float = 1):
+        self._values[labels] = self._values.get(labels, 0) + amount
+    
+    def samples(self) -> List[Sample]:
+        return [(self.name, self._labels(key), value) for key, value in list(self._values.items())]
+
+class Gauge(_Metric):
+    kind = "gauge"
+    
+    def __init__(self, name: str, help_text: str, labelnames: Iterable[str] = ()):
+        super().__init__(name, help_text, labelnames)
+        self._values: Dict[Tuple, float] = {}
+    
+    def inc(self, *labels, amount: float = 1):
+        self._values[labels] = self._values.get(labels, 0) + amount
+    
+    def dec(self, *labels, amount: float = 1):
+        self._values[labels] = self._values.get(labels, 0) - amount
+    
+    def samples(self) -> List[Sample]:
+        return [(self.name, self._labels(key), value) for key, value in list(self._values.items())]
+
+class Histogram(_Metric):
+    kind = "histogram"
+    
+    def __init__(self, name: str, help_text: str, labelnames: Iterable[str] = (), buckets=LATENCY_BUCKETS):
+        super().__init__(name, help_text, labelnames)
+        self.buckets = tuple(buckets)
+        # etiquetas -> [conteo por bucket (no acumulado) + bucket +Inf, suma]
+        self._values: Dict[Tuple, list] = {}
+    
+    def observe(self, value: float, *labels):
+        entry = self._values.get(labels)
+        if entry is None:
+            entry = self._values[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+        entry[0][bisect_left(self.buckets, value)] += 1
+        entry[1] += value
+    
+    def samples(self) -> List[Sample]:
+        result: List[Sample] = []
+        for key, (counts, total) in list(self._values.items()):
+            labels = self._labels(key)
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                result.append((f"{self.name}_bucket", {**labels, "le": _format_value(bound)}, cumulative))
+            result.append((f"{self.name}_sum", labels, total))
+            result.append((f"{self.name}_count", labels, cumulative))
+        return result
+
+class Registry:
+    """
+    Métricas registradas más colectores que, al momento del scrape, leen
+    las estadísticas que ya llevan los componentes (cachés, breakers,
+    pools...), así el camino caliente no paga nada extra por ellas.
+    """
+    
+    def __init__(self):
+        self._metrics: List[_Metric] = []
+        self._collectors: List[Tuple[str, str, str, Callable[[], Iterable[Tuple[Dict[str, str], float]]]]] = []
+    
+    def register(self, metric: _Metric) -> _Metric:
+        self._metrics.append(metric)
+        return metric
+    
+    def collector(self, name: str, kind: str, help_text: str, collect: Callable[[], Iterable[Tuple[Dict[str, str], float]]]):
+        """Registra una familia calculada en cada scrape: collect() -> [(etiquetas, valor)]"""
+        self._collectors.append((name, kind, help_text, collect))
+    
+    def render(self) -> str:
+        """Exposición en formato de texto de Prometheus (version 0.0.4)"""
+        lines: List[str] = []
+        for metric in self._metrics:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            for name, labels, value in metric.samples():
+                lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+        for name, kind, help_text, collect in self._collectors:
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            for labels, value in collect():
+                lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+registry = Registry()
+
+# Métricas registradas en el camino caliente
+http_requests_total = registry.register(Counter(
+    "middleware_http_requests_total", "Peticiones atendidas por el middleware", ("method", "route", "status")
+))
+http_request_duration = registry.register(Histogram(
+    "middleware_http_request_duration_seconds", "Latencia de las peticiones por ruta", ("method", "route")
+))
+http_requests_in_flight = registry.register(Gauge(
+    "middleware_http_requests_in_flight", "Peticiones en curso por ruta", ("route",)
+))
+upstream_requests_total = registry.register(Counter(
+    "middleware_upstream_requests_total", "Peticiones enviadas a App1/App2 (status: código HTTP, error o cancelled)", ("upstream", "instance", "method", "status")
+))
+upstream_request_duration = registry.register(Histogram(
+    "middleware_upstream_request_duration_seconds", "Latencia de las peticiones a App1/App2", ("upstream", "instance", "method")
+))
+
+class InstrumentedTransport(httpx.AsyncBaseTransport):
+    """
+    Transporte de httpx que registra conteo y latencia (hasta los headers)
+    de cada petición upstream, también las que no llegan a tener respuesta:
+    errores de conexión o timeouts (status "error") y llamadas canceladas
+    (status "cancelled", p. ej. el perdedor de un hedge).
+    """
+    
+    def __init__(self, inner: httpx.AsyncBaseTransport, upstream: str, instance: str):
+        self.inner = inner
+        self.upstream = upstream
+        self.instance = instance
+    
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        started = time.monotonic()
+        status = "error"
+        try:
+            response = await self.inner.handle_async_request(request)
+            status = str(response.status_code)
+            return response
+        except asyncio.CancelledError:
+            status = "cancelled"
+            raise
+        finally:
+            upstream_requests_total.inc(self.upstream, self.instance, request.method, status)
+            upstream_request_duration.observe(time.monotonic() - started, self.upstream, self.instance, request.method)
+    
+    async def aclose(self):
+        await self.inner.aclose()
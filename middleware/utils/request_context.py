@@ -0,0 +1,123 @@
+import time
+import asyncio
+from contextvars import ContextVar
+from typing import Dict, Iterable, Optional
+from starlette.datastructures import Headers
+from starlette.responses import JSONResponse
+from starlette.routing import BaseRoute, Match
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+from config import settings
+from utils.errors import DeadlineExceeded
+from utils import metrics
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Milisegundos que le quedan al llamador; App3 lo envía y el middleware lo
+# reenvía (descontado) a App1/App2
+DEADLINE_HEADER = "X-Request-Deadline-Ms"
+
+# Plantilla de la ruta del middleware que atiende la petición en curso
+# (p. ej. "/api/medical-history/{patient_id}"); la fija el middleware HTTP
+# de app.py y la heredan las tareas creadas durante la petición
+current_route: ContextVar[str] = ContextVar("current_route", default="-")
+
+# Instante (time.monotonic()) en que el llamador deja de esperar; None = sin deadline
+request_deadline: ContextVar[Optional[float]] = ContextVar("request_deadline", default=None)
+
+def route_template(routes: Iterable[BaseRoute], scope: dict) -> str:
+    """Plantilla de la ruta que atiende `scope` (cardinalidad acotada, sin RUTs)"""
+    for route in routes:
+        match, _ = route.matches(scope)
+        if match == Match.FULL:
+            return getattr(route, "path", scope["path"])
+    return "unmatched"
+
+def parse_deadline(header: Optional[str]) -> Optional[float]:
+    """
+    Convierte el header de deadline en un instante de time.monotonic(),
+    reservando DEADLINE_MARGIN para devolver la respuesta. None si no viene
+    o no es válido.
+    """
+    try:
+        budget_ms = float(header)
+    except (TypeError, ValueError):
+        return None
+    return time.monotonic() + budget_ms / 1000 - settings.DEADLINE_MARGIN
+
+def remaining() -> Optional[float]:
+    """Segundos que quedan del deadline de la petición en curso (None = sin deadline)"""
+    deadline = request_deadline.get()
+    return None if deadline is None else deadline - time.monotonic()
+
+def attempt_timeout() -> float:
+    """
+    Timeout para una llamada upstream: REQUEST_TIMEOUT acotado a lo que
+    queda del deadline.
+
+    Raises:
+        DeadlineExceeded: si el deadline ya pasó
+    """
+    left = remaining()
+    if left is None:
+        return settings.REQUEST_TIMEOUT
+    if left <= 0:
+        raise DeadlineExceeded("Deadline de la petición agotado")
+    return min(settings.REQUEST_TIMEOUT, left)
+
+def deadline_headers(timeout: float) -> Dict[str, str]:
+    """Header de deadline para reenviar upstream"""
+    return {DEADLINE_HEADER: str(int(timeout * 1000))}
+
+class RequestContextMiddleware:
+    """
+    Middleware ASGI que deja en contexto la plantilla de la ruta (métricas
+    por ruta) y el deadline que envía App3, y registra conteo, latencia y
+    peticiones en curso por ruta.
+    
+    Si el deadline se agota antes de responder, cancela el handler y con él
+    todo el trabajo upstream en curso (reintentos, hedges, fan-outs) y
+    responde 504: App3 ya no está esperando. Es ASGI puro y no
+    BaseHTTPMiddleware porque este último no cancela el handler.
+    """
+    
+    def __init__(self, app: ASGIApp):
+        self.app = app
+    
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        
+        route = route_template(scope["app"].routes, scope)
+        current_route.set(route)
+        request_deadline.set(parse_deadline(Headers(scope=scope).get(DEADLINE_HEADER)))
+        
+        status = 500  # si el handler falla sin responder, ServerErrorMiddleware responde 500
+        response_started = False
+        
+        async def send_wrapper(message: Message):
+            nonlocal status, response_started
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                response_started = True
+            await send(message)
+        
+        started = time.monotonic()
+        metrics.http_requests_in_flight.inc(route)
+        try:
+            left = remaining()
+            if left is None:
+                await self.app(scope, receive, send_wrapper)
+                return
+            try:
+                await asyncio.wait_for(self.app(scope, receive, send_wrapper), timeout=max(left, 0))
+            except asyncio.TimeoutError:
+                logger.warning(f"Deadline agotado en {scope['method']} {scope['path']}; trabajo upstream cancelado")
+                if not response_started:
+                    response = JSONResponse(status_code=504, content={"detail": "Deadline de la petición agotado"})
+                    await response(scope, receive, send_wrapper)
+        finally:
+            metrics.http_requests_in_flight.dec(route)
+            metrics.http_requests_total.inc(scope["method"], route, str(status))
+            metrics.http_request_duration.observe(time.monotonic() - started, scope["method"], route)
@@ -0,0 +1,178 @@
+import asyncio
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Optional
+from config import settings
+from utils.errors import UpstreamUnavailable
+from utils.request_context import request_deadline
+import logging
+
+logger = logging.getLogger(__name__)
+
+class ResponseCache:
+    """
+    Caché de respuestas de rutas de lectura con stale-while-revalidate.
+    
+    Cada entrada es fresca durante `ttl` y luego servible como "stale"
+    durante `stale_ttl` más. Una entrada stale se retorna de inmediato y se
+    lanza una sola revalidación en segundo plano por clave. Si el upstream
+    está caído (UpstreamUnavailable) y no hay entrada, se retorna la
+    respuesta degradada del cliente sin cachearla.
+    """
+    
+    def __init__(self, name: str, max_size: int):
+        self.name = name
+        self.max_size = max_size
+        self._entries: OrderedDict = OrderedDict()  # clave -> (valor, fresco_hasta, stale_hasta)
+        self._refreshing: Dict[str, asyncio.Task] = {}
+        # Una carga iniciada antes de una escritura no debe guardar su
+        # resultado (ya viejo) después de la invalidación. El reloj sube con
+        # cada invalidación y se anota por clave (solo mientras la clave tenga
+        # cargas en curso) y por prefijo; así invalidar una clave no descarta
+        # las cargas de las demás
+        self._clock = 0
+        self._loading: Dict[str, int] = {}  # clave -> cargas en curso
+        self._invalidated: Dict[str, int] = {}  # clave -> reloj de su última invalidación
+        self._prefix_invalidated: Dict[str, int] = {}  # prefijo -> reloj de su última invalidación
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        self.refreshes = 0
+        self.refresh_errors = 0
+    
+    async def get_or_load(
+        self,
+        key: str,
+        loader: Callable[[], Awaitable[Any]],
+        ttl: float,
+        stale_ttl: float,
+        should_cache: Optional[Callable[[Any], bool]] = None
+    ) -> Any:
+        """
+        Retorna la respuesta cacheada para `key` o la carga con `loader`.
+        
+        Args:
+            loader: función sin argumentos que consulta el upstream; debe lanzar
+                    UpstreamUnavailable en lugar de retornar datos de fallback
+            should_cache: predicado opcional para no cachear respuestas parciales
+        """
+        now = time.monotonic()
+        entry = self._entries.get(key)
+        if entry is not None:
+            value, fresh_until, stale_until = entry
+            if now < fresh_until:
+                self.hits += 1
+                self._entries.move_to_end(key)
+                return value
+            if now < stale_until:
+                self.stale_hits += 1
+                self._entries.move_to_end(key)
+                self._schedule_refresh(key, loader, ttl, stale_ttl, should_cache)
+                return value
+            del self._entries[key]
+        
+        self.misses += 1
+        started = self._begin_load(key)
+        try:
+            value = await loader()
+            self._store(key, value, ttl, stale_ttl, should_cache, started)
+            return value
+        except UpstreamUnavailable as e:
+            logger.warning(f"Caché '{self.name}': upstream no disponible para {key}, respuesta degradada")
+            return e.fallback
+        finally:
+            self._end_load(key)
+    
+    def _begin_load(self, key: str) -> int:
+        self._loading[key] = self._loading.get(key, 0) + 1
+        return self._clock
+    
+    def _end_load(self, key: str):
+        count = self._loading[key] - 1
+        if count:
+            self._loading[key] = count
+        else:
+            del self._loading[key]
+            self._invalidated.pop(key, None)
+    
+    def _invalidated_since(self, key: str, started: int) -> bool:
+        """Indica si `key` se invalidó después de que empezara una carga"""
+        if self._invalidated.get(key, 0) > started:
+            return True
+        return any(
+            at > started and key.startswith(prefix)
+            for prefix, at in self._prefix_invalidated.items()
+        )
+    
+    def _store(self, key: str, value: Any, ttl: float, stale_ttl: float, should_cache, started: int):
+        if self._invalidated_since(key, started):
+            return
+        if should_cache is not None and not should_cache(value):
+            return
+        now = time.monotonic()
+        self._entries[key] = (value, now + ttl, now + ttl + stale_ttl)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+    
+    def _schedule_refresh(self, key: str, loader, ttl: float, stale_ttl: float, should_cache):
+        if key in self._refreshing:
+            return
+        task = asyncio.create_task(self._refresh(key, loader, ttl, stale_ttl, should_cache))
+        self._refreshing[key] = task
+        
+        def done(_task):
+            # Una revalidación cancelada por invalidate() no debe quitar otra más nueva
+            if self._refreshing.get(key) is _task:
+                del self._refreshing[key]
+        
+        task.add_done_callback(done)
+    
+    async def _refresh(self, key: str, loader, ttl: float, stale_ttl: float, should_cache):
+        # La revalidación no responde a nadie: no hereda el deadline de la
+        # petición que la disparó (la tarea tiene su propia copia del contexto)
+        request_deadline.set(None)
+        self.refreshes += 1
+        started = self._begin_load(key)
+        try:
+            value = await loader()
+            self._store(key, value, ttl, stale_ttl, should_cache, started)
+        except Exception as e:
+            # Se sigue sirviendo la entrada stale hasta que venza
+            self.refresh_errors += 1
+            logger.warning(f"Caché '{self.name}': revalidación de {key} falló: {e}")
+        finally:
+            self._end_load(key)
+    
+    def invalidate(self, key: str):
+        self._clock += 1
+        if key in self._loading:
+            self._invalidated[key] = self._clock
+        self._entries.pop(key, None)
+        task = self._refreshing.pop(key, None)
+        if task is not None:
+            task.cancel()
+    
+    def invalidate_prefix(self, prefix: str):
+        # También las cargas en curso de claves que aún no están en la caché
+        self._clock += 1
+        self._prefix_invalidated[prefix] = self._clock
+        for key in [k for k in self._entries if k.startswith(prefix)]:
+            self.invalidate(key)
+        for key in [k for k in self._refreshing if k.startswith(prefix)]:
+            self.invalidate(key)
+    
+    def stats(self) -> Dict:
+        return {
+            "size": len(self._entries),
+            "max_size": self.max_size,
+            "hits": self.hits,
+            "stale_hits": self.stale_hits,
+            "misses": self.misses,
+            "refreshes_in_flight": len(self._refreshing),
+            "refreshes": self.refreshes,
+            "refresh_errors": self.refresh_errors
+        }
+
+# Caché compartida por las rutas de lectura del middleware
+response_cache = ResponseCache("responses", settings.RESPONSE_CACHE_SIZE)
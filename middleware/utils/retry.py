@@ -1,39 +1,149 @@
 import time
+import random
 import asyncio
-from typing import Callable, Any, Optional
+import httpx
+from typing import Callable, Any, Dict, Optional
 from config import settings
+from utils.errors import CircuitOpenError
+from utils.request_context import current_route, request_deadline
 import logging
 
 logger = logging.getLogger(__name__)
 
+# Códigos que indican un problema transitorio del upstream
+RETRYABLE_STATUS = {408, 425, 429, 500, 502, 503, 504}
+
+# Errores en los que la petición no llegó a enviarse: se pueden reintentar
+# incluso en operaciones no idempotentes
+_NOT_SENT_ERRORS = (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout)
+
+def is_retryable(error: Exception, idempotent: bool = True) -> bool:
+    """
+    Clasifica un error: solo los transitorios merecen reintento.
+    
+    - 4xx (salvo 408/425/429), errores de validación y circuitos abiertos: no
+    - 5xx transitorios, timeouts y errores de red: sí (si la operación es
+      idempotente; si no, solo cuando la petición no llegó a enviarse)
+    """
+    if isinstance(error, _NOT_SENT_ERRORS):
+        return True
+    if not idempotent:
+        return False
+    if isinstance(error, httpx.HTTPStatusError):
+        return error.response.status_code in RETRYABLE_STATUS
+    return isinstance(error, (httpx.TransportError, asyncio.TimeoutError))
+
+class RetryBudget:
+    """
+    Presupuesto de reintentos por upstream (token bucket).
+    
+    Cada llamada aporta RETRY_BUDGET_RATIO fichas (hasta RETRY_BUDGET_BURST)
+    y cada reintento consume una: los reintentos no superan esa fracción del
+    tráfico, así durante una caída no se multiplica la carga por MAX_RETRIES.
+    """
+    
+    def __init__(self, name: str):
+        self.name = name
+        self.tokens = settings.RETRY_BUDGET_BURST
+    
+    def deposit(self):
+        self.tokens = min(settings.RETRY_BUDGET_BURST, self.tokens + settings.RETRY_BUDGET_RATIO)
+    
+    def withdraw(self) -> bool:
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True
+        return False
+
+retry_budgets: Dict[str, RetryBudget] = {}
+
+def get_retry_budget(upstream: str) -> RetryBudget:
+    budget = retry_budgets.get(upstream)
+    if budget is None:
+        budget = retry_budgets[upstream] = RetryBudget(upstream)
+    return budget
+
+# Métricas de reintentos por ruta del middleware
+retry_stats: Dict[str, Dict[str, int]] = {}
+
+def _route_stats() -> Dict[str, int]:
+    route = current_route.get()
+    stats = retry_stats.get(route)
+    if stats is None:
+        stats = retry_stats[route] = {
+            "calls": 0,
+            "retries": 0,
+            "not_retryable": 0,
+            "budget_exhausted": 0,
+            "deadline_exceeded": 0,
+            "exhausted": 0
+        }
+    return stats
+
 async def retry_with_backoff(
     func: Callable,
     *args,
     max_retries: int = None,
     initial_delay: float = None,
+    upstream: str = "default",
+    idempotent: bool = True,
+    deadline: Optional[float] = None,
     **kwargs
 ) -> Any:
     """
-    Reintenta una función asíncrona con exponential backoff
+    Reintenta una función asíncrona con backoff exponencial y jitter
+    decorrelacionado (espera aleatoria entre el delay inicial y el triple
+    de la anterior, acotada a RETRY_MAX_DELAY).
+    
+    Solo reintenta errores transitorios (ver is_retryable), mientras quede
+    presupuesto de reintentos del upstream y sin pasar de `deadline`
+    (instante de time.monotonic(); por defecto RETRY_DEADLINE segundos
+    desde la primera llamada, o antes si el llamador trae un deadline).
     """
     max_retries = max_retries or settings.MAX_RETRIES
-    delay = initial_delay or settings.RETRY_DELAY
+    base_delay = initial_delay or settings.RETRY_DELAY
+    deadline = deadline or time.monotonic() + settings.RETRY_DEADLINE
+    if request_deadline.get() is not None:
+        deadline = min(deadline, request_deadline.get())
+    budget = get_retry_budget(upstream)
+    stats = _route_stats()
     
-    last_exception = None
+    stats["calls"] += 1
+    budget.deposit()
+    delay = base_delay
     
     for attempt in range(max_retries):
         try:
             return await func(*args, **kwargs)
         except Exception as e:
-            last_exception = e
-            if attempt < max_retries - 1:
-                wait_time = delay * (2 ** attempt)
-                logger.warning(
-                    f"Intento {attempt + 1}/{max_retries} falló: {str(e)}. "
-                    f"Reintentando en {wait_time}s..."
-                )
-                await asyncio.sleep(wait_time)
-            else:
+            if not is_retryable(e, idempotent):
+                if not isinstance(e, CircuitOpenError):
+                    stats["not_retryable"] += 1
+                raise
+            if attempt == max_retries - 1:
+                stats["exhausted"] += 1
                 logger.error(f"Todos los reintentos fallaron: {str(e)}")
-    
-    raise last_exception
+                raise
+            
+            delay = min(settings.RETRY_MAX_DELAY, random.uniform(base_delay, delay * 3))
+            if time.monotonic() + delay >= deadline:
+                stats["deadline_exceeded"] += 1
+                logger.error(f"Sin tiempo para reintentar ({upstream}): {str(e)}")
+                raise
+            if not budget.withdraw():
+                stats["budget_exhausted"] += 1
+                logger.error(f"Presupuesto de reintentos de {upstream} agotado: {str(e)}")
+                raise
+            
+            stats["retries"] += 1
+            logger.warning(
+                f"Intento {attempt + 1}/{max_retries} falló: {str(e)}. "
+                f"Reintentando en {delay:.2f}s..."
+            )
+            await asyncio.sleep(delay)
+
+def retry_budget_stats() -> Dict:
+    return {
+        "budgets": {name: round(budget.tokens, 2) for name, budget in retry_budgets.items()},
+        "routes": {route: dict(stats) for route, stats in retry_stats.items()}
+    }
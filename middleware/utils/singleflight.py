@@ -0,0 +1,99 @@
+import asyncio
+import contextvars
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict
+from utils.errors import DeadlineExceeded
+from utils.request_context import remaining, request_deadline
+import logging
+
+logger = logging.getLogger(__name__)
+
+class _Call:
+    """Una llamada upstream en curso y cuántos llamadores la esperan"""
+    
+    def __init__(self, task: asyncio.Task):
+        self.task = task
+        self.waiters = 0
+
+class SingleFlight:
+    """
+    Coalescencia de peticiones (single-flight).
+    
+    Las llamadas concurrentes con la misma clave comparten una única
+    ejecución upstream:
+    - El resultado o la excepción se entrega a todos los que esperan
+    - Si un llamador se cancela, los demás siguen esperando; la ejecución
+      upstream solo se cancela cuando ya no queda nadie esperándola
+    - La ejecución compartida corre sin el deadline del llamador que la
+      inició (un líder apurado no debe hacer fallar a los demás); cada
+      llamador espera a lo más lo que le queda de su propio deadline
+    - Métricas por clave (acotadas a las `max_tracked_keys` más recientes)
+    """
+    
+    def __init__(self, name: str, max_tracked_keys: int = 500):
+        self.name = name
+        self.max_tracked_keys = max_tracked_keys
+        self._inflight: Dict[str, _Call] = {}
+        self._metrics: OrderedDict = OrderedDict()
+    
+    def _metric(self, key: str) -> Dict[str, int]:
+        metric = self._metrics.get(key)
+        if metric is None:
+            metric = self._metrics[key] = {
+                "calls": 0, "executions": 0, "coalesced": 0, "errors": 0, "cancelled": 0
+            }
+            while len(self._metrics) > self.max_tracked_keys:
+                self._metrics.popitem(last=False)
+        else:
+            self._metrics.move_to_end(key)
+        return metric
+    
+    def _forget(self, key: str, call: _Call):
+        if self._inflight.get(key) is call:
+            del self._inflight[key]
+    
+    async def do(self, key: str, fn: Callable[[], Awaitable[Any]]) -> Any:
+        """Ejecuta fn() o se une a la ejecución en curso con la misma clave"""
+        metric = self._metric(key)
+        metric["calls"] += 1
+        
+        call = self._inflight.get(key)
+        if call is None:
+            # Copia del contexto (ruta para métricas) sin el deadline del líder
+            context = contextvars.copy_context()
+            context.run(request_deadline.set, None)
+            call = _Call(context.run(lambda: asyncio.ensure_future(fn())))
+            self._inflight[key] = call
+            call.task.add_done_callback(lambda _task: self._forget(key, call))
+            metric["executions"] += 1
+        else:
+            metric["coalesced"] += 1
+        
+        call.waiters += 1
+        try:
+            return await asyncio.wait_for(asyncio.shield(call.task), remaining())
+        except (asyncio.CancelledError, asyncio.TimeoutError) as e:
+            if call.task.done():
+                # Error de la propia ejecución upstream, no del deadline de este llamador
+                if not isinstance(e, asyncio.CancelledError):
+                    metric["errors"] += 1
+                raise
+            if call.waiters == 1:
+                # Último interesado: cancelar la llamada upstream
+                self._forget(key, call)
+                call.task.cancel()
+                metric["cancelled"] += 1
+            if isinstance(e, asyncio.TimeoutError):
+                raise DeadlineExceeded("Deadline de la petición agotado esperando la llamada compartida") from None
+            raise
+        except Exception:
+            metric["errors"] += 1
+            raise
+        finally:
+            call.waiters -= 1
+    
+    def stats(self) -> Dict:
+        return {
+            "in_flight": len(self._inflight),
+            "keys": {key: dict(metric) for key, metric in self._metrics.items()}
+        }